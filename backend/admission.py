@@ -0,0 +1,317 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from metrics import registry as metrics_registry
+from models import LlmBackend, LlmLease, LlmTokenBucket
+from prompt_builder import estimate_tokens
+
+# Admission control in front of every LLM call, in two steps:
+#
+# 1. admit() charges the user's token bucket with the estimated size of the
+#    request (prompt plus an expected reply). A user who is out of budget gets
+#    AdmissionRejected with a retry delay instead of a place in the queue.
+# 2. acquire() waits for a slot on the chosen Ollama host. Waiters are served
+#    interactive lane first, then by weighted fair queuing: each request gets
+#    a virtual finish tag of max(host virtual time, user's last tag) + cost /
+#    weight, and the lowest tag goes next, so a user with many or huge
+#    requests cannot crowd out everyone else. A few slots per host are kept
+#    for interactive traffic so background jobs never fill a host on their own.
+#
+# With LLM_SCHEDULER_STORE=database the buckets and slot leases live in the
+# database and hold across web and job worker processes; 'local' keeps them in
+# process memory. The queue order itself is per process: the head waiter of
+# each process polls the shared slot count. Held leases are renewed by a
+# heartbeat thread every LLM_LEASE_TTL / 3 seconds, so a generation that
+# produces no output for a long time (a model load, a long prompt eval)
+# keeps its slot, while a crashed process's leases still run out.
+
+INTERACTIVE = 0
+BACKGROUND = 1
+LANES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'Token budget exhausted, retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+def request_cost(*texts, context=None):
+    # Tokens a generation is charged for: prompt text, any Ollama context
+    # that will be re-read, and the expected reply
+    tokens = sum(estimate_tokens(text) for text in texts if text) + len(context or ())
+    return tokens + app.config['LLM_REPLY_TOKEN_ESTIMATE']
+
+
+def slot_limit(priority):
+    limit = app.config['OLLAMA_MAX_CONCURRENCY_PER_HOST']
+    if priority == BACKGROUND:
+        return max(limit - app.config['LLM_INTERACTIVE_RESERVED_SLOTS'], 1)
+    return limit
+
+
+def user_weights():
+    weights = {}
+    for item in app.config['LLM_USER_WEIGHTS'].split(','):
+        if ':' in item:
+            user_id, weight = item.split(':', 1)
+            weights[int(user_id)] = float(weight)
+    return weights
+
+
+class LocalStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._leases = defaultdict(dict)
+
+    def take_tokens(self, user_id, cost, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(user_id, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            self._buckets[user_id] = (tokens - cost, now)
+            return 0
+
+    def try_lease(self, url, user_id, priority, ttl):
+        now = time.monotonic()
+        with self._lock:
+            leases = self._leases[url]
+            for lease_id in [lease_id for lease_id, (_, expires) in leases.items() if expires < now]:
+                del leases[lease_id]
+            held = [lease_priority for lease_priority, _ in leases.values()]
+            if len(held) >= slot_limit(INTERACTIVE):
+                return None
+            if priority == BACKGROUND and held.count(BACKGROUND) >= slot_limit(BACKGROUND):
+                return None
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = (priority, now + ttl)
+            return lease_id
+
+    def renew(self, lease_ids, ttl):
+        with self._lock:
+            for leases in self._leases.values():
+                for lease_id in lease_ids:
+                    if lease_id in leases:
+                        priority, _ = leases[lease_id]
+                        leases[lease_id] = (priority, time.monotonic() + ttl)
+
+    def release(self, url, lease_id):
+        with self._lock:
+            self._leases[url].pop(lease_id, None)
+
+
+class DatabaseStore:
+    # Uses short transactions on its own connections, outside the request's
+    # session, so waiting for a slot never holds a session open
+    def __init__(self):
+        self._engine = None
+        self._known_urls = set()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    def take_tokens(self, user_id, cost, rate, burst, retry=True):
+        buckets = LlmTokenBucket.__table__
+        now = datetime.utcnow()
+        try:
+            return self._take_tokens(buckets, user_id, cost, rate, burst, now)
+        except IntegrityError:
+            # Another process created the user's bucket first
+            if not retry:
+                raise
+            return self.take_tokens(user_id, cost, rate, burst, retry=False)
+
+    def _take_tokens(self, buckets, user_id, cost, rate, burst, now):
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                db.select(buckets.c.tokens, buckets.c.updated_at)
+                .where(buckets.c.user_id == user_id).with_for_update()
+            ).first()
+            tokens = burst if row is None else min(burst, row.tokens + (now - row.updated_at).total_seconds() * rate)
+            if tokens < cost:
+                return (cost - tokens) / rate
+            if row is None:
+                conn.execute(db.insert(buckets).values(user_id=user_id, tokens=tokens - cost, updated_at=now))
+            else:
+                conn.execute(db.update(buckets).where(buckets.c.user_id == user_id)
+                             .values(tokens=tokens - cost, updated_at=now))
+            return 0
+
+    def _ensure_backend(self, url):
+        if url in self._known_urls:
+            return
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(db.insert(LlmBackend.__table__).values(url=url))
+        except IntegrityError:
+            pass
+        self._known_urls.add(url)
+
+    def try_lease(self, url, user_id, priority, ttl):
+        self._ensure_backend(url)
+        backends, leases = LlmBackend.__table__, LlmLease.__table__
+        now = datetime.utcnow()
+        with self.engine.begin() as conn:
+            # Touching the host row serialises grants for this host, on
+            # PostgreSQL through the row lock and on SQLite through the write lock
+            conn.execute(db.update(backends).where(backends.c.url == url).values(locked_at=now))
+            conn.execute(db.delete(leases).where(leases.c.url == url, leases.c.expires_at < now))
+            held = dict(conn.execute(
+                db.select(leases.c.priority, db.func.count()).where(leases.c.url == url).group_by(leases.c.priority)
+            ).all())
+            if sum(held.values()) >= slot_limit(INTERACTIVE):
+                return None
+            if priority == BACKGROUND and held.get(BACKGROUND, 0) >= slot_limit(BACKGROUND):
+                return None
+            lease_id = uuid.uuid4().hex
+            conn.execute(db.insert(leases).values(id=lease_id, url=url, user_id=user_id, priority=priority,
+                                                  expires_at=now + timedelta(seconds=ttl)))
+            return lease_id
+
+    def renew(self, lease_ids, ttl):
+        leases = LlmLease.__table__
+        with self.engine.begin() as conn:
+            conn.execute(db.update(leases).where(leases.c.id.in_(lease_ids))
+                         .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+
+    def release(self, url, lease_id):
+        leases = LlmLease.__table__
+        with self.engine.begin() as conn:
+            conn.execute(db.delete(leases).where(leases.c.id == lease_id))
+
+
+class Lease:
+    def __init__(self, scheduler, url, lease_id):
+        self.scheduler = scheduler
+        self.url = url
+        self.id = lease_id
+
+    def release(self):
+        self.scheduler.release(self)
+
+
+class Scheduler:
+    def __init__(self, store=None):
+        self._store = store
+        self._cond = threading.Condition()
+        self._queues = defaultdict(list)
+        self._virtual_time = defaultdict(float)
+        self._last_finish = {}
+        self._sequence = itertools.count()
+        self._weights = None
+        self._held = set()
+        self._held_lock = threading.Lock()
+        self._heartbeat = None
+        self._heartbeat_pid = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = DatabaseStore() if app.config['LLM_SCHEDULER_STORE'] == 'database' else LocalStore()
+        return self._store
+
+    def weight(self, user_id):
+        if self._weights is None:
+            self._weights = user_weights()
+        return self._weights.get(user_id, 1.0)
+
+    def admit(self, user_id, cost):
+        # Requests larger than the burst would never fit, so they are charged
+        # a full bucket instead
+        burst = app.config['LLM_USER_TOKEN_BURST']
+        retry_after = self.store.take_tokens(user_id, min(cost, burst),
+                                             app.config['LLM_USER_TOKENS_PER_MINUTE'] / 60, burst)
+        if retry_after:
+            metrics_registry.increment('llm_admission_rejected_total')
+            raise AdmissionRejected(retry_after)
+
+    def acquire(self, url, user_id=None, priority=INTERACTIVE, cost=1, timeout=None):
+        # Returns a Lease, or None if no slot came free within timeout. The
+        # store is polled outside the condition lock, so a slow database only
+        # delays the waiter that is polling, not every host's queue.
+        started = time.monotonic()
+        deadline = started + (timeout if timeout is not None else app.config['OLLAMA_QUEUE_TIMEOUT'])
+        poll_interval = app.config['LLM_SCHEDULER_POLL_INTERVAL']
+        with self._cond:
+            queue = self._queues[url]
+            start = max(self._virtual_time[url], self._last_finish.get((url, user_id), 0))
+            finish = start + cost / self.weight(user_id)
+            self._last_finish[(url, user_id)] = finish
+            entry = (priority, finish, next(self._sequence))
+            heapq.heappush(queue, entry)
+        try:
+            while True:
+                with self._cond:
+                    at_head = queue[0] is entry
+                if at_head:
+                    lease_id = self.store.try_lease(url, user_id, priority, app.config['LLM_LEASE_TTL'])
+                    if lease_id:
+                        with self._cond:
+                            self._virtual_time[url] = max(self._virtual_time[url], start)
+                        metrics_registry.observe_queue_wait(LANES[priority], time.monotonic() - started)
+                        return self._hold(Lease(self, url, lease_id))
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics_registry.increment('llm_queue_timeouts_total')
+                    return None
+                with self._cond:
+                    self._cond.wait(min(remaining, poll_interval))
+        finally:
+            with self._cond:
+                if entry in queue:
+                    queue.remove(entry)
+                    heapq.heapify(queue)
+                # Whoever is at the head now gets its turn
+                self._cond.notify_all()
+
+    def release(self, lease):
+        with self._held_lock:
+            self._held.discard(lease.id)
+        self.store.release(lease.url, lease.id)
+        with self._cond:
+            self._cond.notify_all()
+
+    def _hold(self, lease):
+        with self._held_lock:
+            self._held.add(lease.id)
+        # Threads do not survive fork, so each process starts its own
+        if self._heartbeat_pid != os.getpid():
+            with self._held_lock:
+                if self._heartbeat_pid != os.getpid():
+                    self._heartbeat = threading.Thread(target=self._renew_loop, name='llm-lease-heartbeat',
+                                                       daemon=True)
+                    self._heartbeat.start()
+                    self._heartbeat_pid = os.getpid()
+        return lease
+
+    def _renew_loop(self):
+        while True:
+            ttl = app.config['LLM_LEASE_TTL']
+            time.sleep(ttl / 3)
+            with self._held_lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                self.store.renew(held, ttl)
+            except Exception:
+                app.logger.exception("Renewing LLM slot leases failed")
+
+
+scheduler = Scheduler()
@@ -3,32 +3,184 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 import time
-from sqlalchemy.exc import OperationalError
 import os
 from datetime import timedelta
 from flask_session import Session
+from request_logging import configure_logging
+
+BOOT_STARTED = time.perf_counter()
+
+if __name__ == '__main__':
+    # Register this script as the 'app' module so that routes, models and the
+    # other modules importing it share this app instead of loading a second one
+    import sys
+    sys.modules['app'] = sys.modules['__main__']
 
 # Add this line to get the DELETE_DB_ON_STARTUP environment variable
 DELETE_DB_ON_STARTUP = os.environ.get('DELETE_DB_ON_STARTUP', 'false').lower() == 'true'
 
 app = Flask(__name__, template_folder=os.path.abspath('templates'), static_folder=os.path.abspath('static'))
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your_secret_key')
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_PERMANENT'] = True
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
-app.config['SESSION_FILE_DIR'] = os.path.join(app.root_path, 'flask_session')
-app.config['SESSION_USE_SIGNER'] = True
-Session(app)
+
+# Session storage: 'database' (shared by all containers, see session_store.py),
+# 'cookie' (signed client-side cookie) or 'filesystem' (the old Flask-Session store)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'database')
+app.config['SESSION_CLEANUP_INTERVAL'] = float(os.environ.get('SESSION_CLEANUP_INTERVAL', '300'))
+if SESSION_BACKEND == 'filesystem':
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SESSION_PERMANENT'] = True
+    app.config['SESSION_FILE_DIR'] = os.path.join(app.root_path, 'flask_session')
+    app.config['SESSION_USE_SIGNER'] = True
+    Session(app)
+elif SESSION_BACKEND == 'cookie':
+    # Only send a new cookie when the session actually changed
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+# Logging: LOG_SAMPLE_RATE is the share of ordinary requests that get an access
+# log line; errors and requests slower than LOG_SLOW_REQUEST_SECONDS always do.
+# LOG_ROUTE_LEVELS overrides the level per endpoint, e.g. "project_chat:DEBUG".
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO')
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json')
+app.config['LOG_SAMPLE_RATE'] = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+app.config['LOG_SLOW_REQUEST_SECONDS'] = float(os.environ.get('LOG_SLOW_REQUEST_SECONDS', '1'))
+app.config['LOG_ROUTE_LEVELS'] = os.environ.get('LOG_ROUTE_LEVELS', '')
+app.config['LOG_QUEUE_SIZE'] = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+configure_logging(app)
 
 # Use the DATABASE_URL environment variable
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'postgresql://user:password@db:5432/idea_incubator')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool per process. DB_MAX_CONNECTIONS is the budget for the whole
+# web server, split between its WEB_CONCURRENCY worker processes (see
+# gunicorn.conf.py); DB_POOL_SIZE and DB_MAX_OVERFLOW override the split.
+WEB_CONCURRENCY = max(int(os.environ.get('WEB_CONCURRENCY', '1')), 1)
+DB_CONNECTIONS_PER_PROCESS = max(int(os.environ.get('DB_MAX_CONNECTIONS', '30')) // WEB_CONCURRENCY, 2)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', str(max(DB_CONNECTIONS_PER_PROCESS // 3, 1))))
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_size': 10,
-    'max_overflow': 20,
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', str(max(DB_CONNECTIONS_PER_PROCESS - DB_POOL_SIZE, 0)))),
     'pool_pre_ping': True,
 }
 
+# Ollama upstream connection settings
+app.config['OLLAMA_CONNECT_TIMEOUT'] = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', '5'))
+app.config['OLLAMA_READ_TIMEOUT'] = float(os.environ.get('OLLAMA_READ_TIMEOUT', '300'))
+app.config['OLLAMA_POOL_CONNECTIONS'] = int(os.environ.get('OLLAMA_POOL_CONNECTIONS', '4'))
+app.config['OLLAMA_POOL_MAXSIZE'] = int(os.environ.get('OLLAMA_POOL_MAXSIZE', '20'))
+# Generations beyond this many per Ollama host wait in line instead of piling onto the GPU
+app.config['OLLAMA_MAX_CONCURRENCY_PER_HOST'] = int(os.environ.get('OLLAMA_MAX_CONCURRENCY_PER_HOST', '4'))
+app.config['OLLAMA_QUEUE_TIMEOUT'] = float(os.environ.get('OLLAMA_QUEUE_TIMEOUT', '120'))
+app.config['OLLAMA_HEALTH_CHECK_INTERVAL'] = float(os.environ.get('OLLAMA_HEALTH_CHECK_INTERVAL', '15'))
+app.config['OLLAMA_KEEP_ALIVE'] = os.environ.get('OLLAMA_KEEP_ALIVE', '30m')
+
+# LLM admission control (see admission.py). LLM_SCHEDULER_STORE is 'database'
+# to share budgets and host slots between processes, or 'local' for a single
+# process. LLM_USER_WEIGHTS gives users a larger fair share, e.g. "1:2,7:0.5".
+app.config['LLM_SCHEDULER_STORE'] = os.environ.get('LLM_SCHEDULER_STORE', 'database')
+app.config['LLM_USER_TOKENS_PER_MINUTE'] = float(os.environ.get('LLM_USER_TOKENS_PER_MINUTE', '30000'))
+app.config['LLM_USER_TOKEN_BURST'] = float(os.environ.get('LLM_USER_TOKEN_BURST', '16000'))
+app.config['LLM_REPLY_TOKEN_ESTIMATE'] = int(os.environ.get('LLM_REPLY_TOKEN_ESTIMATE', '256'))
+app.config['LLM_USER_WEIGHTS'] = os.environ.get('LLM_USER_WEIGHTS', '')
+app.config['LLM_INTERACTIVE_RESERVED_SLOTS'] = int(os.environ.get('LLM_INTERACTIVE_RESERVED_SLOTS', '1'))
+app.config['LLM_LEASE_TTL'] = float(os.environ.get('LLM_LEASE_TTL', '60'))
+app.config['LLM_SCHEDULER_POLL_INTERVAL'] = float(os.environ.get('LLM_SCHEDULER_POLL_INTERVAL', '0.1'))
+
+# Model catalog (/api/tags) and warm-up of role-assigned models; the warm-up
+# runs in the job worker (worker.py)
+app.config['MODEL_CATALOG_TTL'] = float(os.environ.get('MODEL_CATALOG_TTL', '300'))
+app.config['MODEL_WARMUP_ENABLED'] = os.environ.get('MODEL_WARMUP_ENABLED', 'true').lower() == 'true'
+app.config['MODEL_WARMUP_INTERVAL'] = float(os.environ.get('MODEL_WARMUP_INTERVAL', '240'))
+app.config['MODEL_ACTIVE_WINDOW'] = float(os.environ.get('MODEL_ACTIVE_WINDOW', '3600'))
+
+# Multi-role panel requests
+app.config['PANEL_MAX_WORKERS'] = int(os.environ.get('PANEL_MAX_WORKERS', '16'))
+app.config['PANEL_ROLE_TIMEOUT'] = float(os.environ.get('PANEL_ROLE_TIMEOUT', '180'))
+
+# Prompt assembly: tokens available for system prompt, history and prompt, with
+# part of the window held back for the reply. MODEL_TOKEN_BUDGETS overrides the
+# default per model, e.g. "llama3:8192,mistral:32768".
+app.config['PROMPT_TOKEN_BUDGET'] = int(os.environ.get('PROMPT_TOKEN_BUDGET', '4096'))
+app.config['MODEL_TOKEN_BUDGETS'] = os.environ.get('MODEL_TOKEN_BUDGETS', '')
+app.config['PROMPT_RESPONSE_RESERVE'] = int(os.environ.get('PROMPT_RESPONSE_RESERVE', '1024'))
+
+# Project memory (see project_memory.py): embeddings of project descriptions and
+# messages, searched to add relevant context to chat prompts. EMBEDDING_BACKEND
+# can be 'ollama' or 'stub' (no model needed, for tests).
+app.config['EMBEDDING_ENABLED'] = os.environ.get('EMBEDDING_ENABLED', 'true').lower() == 'true'
+app.config['EMBEDDING_BACKEND'] = os.environ.get('EMBEDDING_BACKEND', 'ollama')
+app.config['EMBEDDING_MODEL'] = os.environ.get('EMBEDDING_MODEL', 'nomic-embed-text')
+app.config['EMBEDDING_INDEX_DIR'] = os.environ.get('EMBEDDING_INDEX_DIR', os.path.join(app.root_path, 'embedding_index'))
+app.config['EMBEDDING_CHUNK_CHARS'] = int(os.environ.get('EMBEDDING_CHUNK_CHARS', '1200'))
+app.config['EMBEDDING_CHUNK_OVERLAP'] = int(os.environ.get('EMBEDDING_CHUNK_OVERLAP', '200'))
+app.config['EMBEDDING_BATCH_SIZE'] = int(os.environ.get('EMBEDDING_BATCH_SIZE', '32'))
+app.config['EMBEDDING_BATCH_DELAY'] = float(os.environ.get('EMBEDDING_BATCH_DELAY', '2'))
+app.config['EMBEDDING_QUERY_TIMEOUT'] = float(os.environ.get('EMBEDDING_QUERY_TIMEOUT', '2'))
+app.config['RAG_TOP_K'] = int(os.environ.get('RAG_TOP_K', '4'))
+app.config['RAG_MIN_SCORE'] = float(os.environ.get('RAG_MIN_SCORE', '0.35'))
+
+# Web search for roles with web_search enabled (see web_search.py).
+# WEB_SEARCH_BACKEND is 'searxng' (WEB_SEARCH_URL points at the instance) or
+# 'stub'; WEB_SEARCH_TIMEOUT bounds the whole search stage of a chat turn.
+app.config['WEB_SEARCH_BACKEND'] = os.environ.get('WEB_SEARCH_BACKEND', 'searxng')
+app.config['WEB_SEARCH_URL'] = os.environ.get('WEB_SEARCH_URL', '')
+app.config['WEB_SEARCH_RESULTS'] = int(os.environ.get('WEB_SEARCH_RESULTS', '3'))
+app.config['WEB_SEARCH_TIMEOUT'] = float(os.environ.get('WEB_SEARCH_TIMEOUT', '0.8'))
+app.config['WEB_SEARCH_CONNECT_TIMEOUT'] = float(os.environ.get('WEB_SEARCH_CONNECT_TIMEOUT', '2'))
+app.config['WEB_SEARCH_READ_TIMEOUT'] = float(os.environ.get('WEB_SEARCH_READ_TIMEOUT', '5'))
+app.config['WEB_SEARCH_FETCH_WORKERS'] = int(os.environ.get('WEB_SEARCH_FETCH_WORKERS', '16'))
+app.config['WEB_SEARCH_MAX_QUERY_CHARS'] = int(os.environ.get('WEB_SEARCH_MAX_QUERY_CHARS', '200'))
+app.config['WEB_SEARCH_MAX_REDIRECTS'] = int(os.environ.get('WEB_SEARCH_MAX_REDIRECTS', '3'))
+app.config['WEB_SEARCH_MAX_PAGE_BYTES'] = int(os.environ.get('WEB_SEARCH_MAX_PAGE_BYTES', str(512 * 1024)))
+app.config['WEB_SEARCH_MAX_CHARS'] = int(os.environ.get('WEB_SEARCH_MAX_CHARS', '1500'))
+app.config['WEB_SEARCH_CACHE_TTL'] = float(os.environ.get('WEB_SEARCH_CACHE_TTL', '3600'))
+app.config['WEB_SEARCH_FAILURE_TTL'] = float(os.environ.get('WEB_SEARCH_FAILURE_TTL', '60'))
+app.config['WEB_SEARCH_CACHE_BYTES'] = int(os.environ.get('WEB_SEARCH_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+# LLM call telemetry rolled up into time buckets (see telemetry.py)
+app.config['TELEMETRY_ENABLED'] = os.environ.get('TELEMETRY_ENABLED', 'true').lower() == 'true'
+app.config['TELEMETRY_BUCKET_SECONDS'] = int(os.environ.get('TELEMETRY_BUCKET_SECONDS', '300'))
+app.config['TELEMETRY_FLUSH_INTERVAL'] = float(os.environ.get('TELEMETRY_FLUSH_INTERVAL', '10'))
+app.config['TELEMETRY_RETENTION_DAYS'] = int(os.environ.get('TELEMETRY_RETENTION_DAYS', '90'))
+
+# Rows per batch for NDJSON export/import (see transfer.py)
+app.config['TRANSFER_BATCH_SIZE'] = int(os.environ.get('TRANSFER_BATCH_SIZE', '5000'))
+
+# Cache lifetime of fingerprinted assets under /assets/ (see assets.py)
+app.config['ASSET_MAX_AGE'] = int(os.environ.get('ASSET_MAX_AGE', str(365 * 24 * 3600)))
+
+# Prometheus-style /metrics endpoint
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Password hashing (see passwords.py). PASSWORD_HASH_WORKERS=0 hashes on the
+# request thread instead of in a process pool.
+app.config['PASSWORD_HASH_ITERATIONS'] = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '1000000'))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.environ.get('PASSWORD_HASH_QUEUE_SIZE', '16'))
+
+# Failed login throttling
+app.config['LOGIN_MAX_ATTEMPTS_PER_USER'] = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_USER', '5'))
+app.config['LOGIN_MAX_ATTEMPTS_PER_IP'] = int(os.environ.get('LOGIN_MAX_ATTEMPTS_PER_IP', '20'))
+app.config['LOGIN_THROTTLE_WINDOW'] = float(os.environ.get('LOGIN_THROTTLE_WINDOW', '300'))
+
+# Background agent jobs (see worker.py)
+app.config['JOB_WORKER_CONCURRENCY'] = int(os.environ.get('JOB_WORKER_CONCURRENCY', '4'))
+app.config['JOB_MODEL_CONCURRENCY'] = int(os.environ.get('JOB_MODEL_CONCURRENCY', '2'))
+app.config['JOB_MODEL_CONCURRENCY_OVERRIDES'] = os.environ.get('JOB_MODEL_CONCURRENCY_OVERRIDES', '')  # e.g. "llama3:1,mistral:3"
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+app.config['JOB_RETRY_BACKOFF'] = float(os.environ.get('JOB_RETRY_BACKOFF', '10'))
+app.config['JOB_LOCK_TIMEOUT'] = float(os.environ.get('JOB_LOCK_TIMEOUT', '900'))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', '1'))
+
+# How often each worker checks the shared cache version counters (seconds)
+app.config['CACHE_VERSION_CHECK_INTERVAL'] = float(os.environ.get('CACHE_VERSION_CHECK_INTERVAL', '1'))
+
+# LLM response cache for roles with cache_responses enabled; the disk tier is
+# off unless RESPONSE_CACHE_DIR is set
+app.config['RESPONSE_CACHE_MEMORY_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MEMORY_BYTES', str(32 * 1024 * 1024)))
+app.config['RESPONSE_CACHE_DIR'] = os.environ.get('RESPONSE_CACHE_DIR') or None
+app.config['RESPONSE_CACHE_DISK_BYTES'] = int(os.environ.get('RESPONSE_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
@@ -53,48 +205,27 @@ def load_user(user_id):
 from routes import *
 from models import *
 
-def connect_to_database(retries=5, delay=5):
-    for attempt in range(retries):
-        try:
-            with app.app_context():
-                if DELETE_DB_ON_STARTUP:
-                    delete_all_tables()
-                db.create_all()
-            print("Successfully connected to the database!")
-            return
-        except OperationalError as e:
-            if attempt < retries - 1:
-                print(f"Database connection attempt {attempt + 1} failed: {e}. Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print("Failed to connect to the database after multiple attempts.")
-                raise e
+if SESSION_BACKEND == 'database':
+    from session_store import DatabaseSessionInterface
+    app.session_interface = DatabaseSessionInterface()
+
+# Fast boot: migrations are applied by migrate.py, so start-up only checks
+# that the schema is at the expected Alembic revision
+app.config['MIGRATE_ON_STARTUP'] = os.environ.get('MIGRATE_ON_STARTUP', 'false').lower() == 'true'
+
+def prepare_database():
+    from schema import check_schema, wait_for_database
+    wait_for_database()
+    ok, current, expected = check_schema()
+    if not ok and app.config['MIGRATE_ON_STARTUP']:
+        from migrate import run_migrations
+        run_migrations()
+    elif not ok:
+        raise SystemExit(
+            f"Database schema is at {sorted(current) or 'no revision'}, expected {sorted(expected)}. "
+            "Run 'python migrate.py' first.")
 
 if __name__ == '__main__':
-    connect_to_database()
-    with app.app_context():
-        db.create_all()
-        if not os.path.exists('migrations'):
-            os.system('flask db init')
-        os.system('flask db migrate')
-        os.system('flask db upgrade')
-        
-        # Verify that the 'temperature' column exists
-        from sqlalchemy import inspect, text
-        inspector = inspect(db.engine)
-        columns = inspector.get_columns('role')
-        if 'temperature' not in [col['name'] for col in columns]:
-            print("Warning: 'temperature' column is still missing from 'role' table!")
-            print("Attempting to add 'temperature' column manually...")
-            with db.engine.connect() as connection:
-                connection.execute(text("ALTER TABLE role ADD COLUMN IF NOT EXISTS temperature FLOAT DEFAULT 0.7 NOT NULL"))
-                connection.execute(text("UPDATE role SET temperature = 0.7 WHERE temperature IS NULL"))
-            print("Manual addition of 'temperature' column completed.")
-        else:
-            print("'temperature' column exists in 'role' table.")
-    
-    # Ensure all models are up-to-date with the database schema
-    with app.app_context():
-        db.create_all()
-    
+    prepare_database()
+    print(f"Ready in {time.perf_counter() - BOOT_STARTED:.2f}s")
     app.run(host='0.0.0.0', port=5000)
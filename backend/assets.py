@@ -0,0 +1,92 @@
+import json
+import mimetypes
+import os
+import threading
+
+from flask import abort, request, send_from_directory, url_for
+
+from app import app
+from build_assets import MANIFEST_NAME
+
+# Serves the fingerprinted assets written by build_assets.py. Templates call
+# asset_url('css/base.css'), which returns /assets/css/base.<hash>.css when the
+# file is in the manifest and falls back to the plain /static/ URL otherwise,
+# so development works without a build. Hashed URLs never change content, so
+# they are sent with an immutable Cache-Control and browsers stop asking for
+# them; the .br or .gz variant is picked from Accept-Encoding.
+
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+class AssetManifest:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._sources = {}
+        self._hashed = {}
+
+    @property
+    def dist_dir(self):
+        return os.path.join(app.static_folder, 'dist')
+
+    def _load(self):
+        # Once per process, or whenever the file changes in debug mode
+        path = os.path.join(self.dist_dir, MANIFEST_NAME)
+        if self._loaded_mtime is not None and not app.debug:
+            return
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = 0
+        if mtime == self._loaded_mtime:
+            return
+        with self._lock:
+            if mtime == self._loaded_mtime:
+                return
+            entries = {}
+            if mtime:
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        entries = json.load(f)
+                except (OSError, ValueError) as e:
+                    app.logger.warning("Could not read asset manifest %s: %s", path, e)
+            self._sources = entries
+            self._hashed = {entry['path']: entry for entry in entries.values()}
+            self._loaded_mtime = mtime
+
+    def source(self, filename):
+        self._load()
+        return self._sources.get(filename)
+
+    def hashed(self, filename):
+        self._load()
+        return self._hashed.get(filename)
+
+
+manifest = AssetManifest()
+
+
+@app.template_global()
+def asset_url(filename):
+    entry = manifest.source(filename)
+    if entry is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=entry['path'])
+
+
+def send_asset(filename):
+    entry = manifest.hashed(filename)
+    if entry is None:
+        abort(404)
+    accepted = request.accept_encodings
+    encoding = next((name for name in entry['encodings'] if accepted.quality(name) > 0), None)
+    max_age = app.config['ASSET_MAX_AGE']
+    response = send_from_directory(manifest.dist_dir, filename + SUFFIXES.get(encoding, ''),
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                   max_age=max_age)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
@@ -0,0 +1,257 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+# Drives the running backend with concurrent virtual users. Each user logs in
+# once, then loops over a weighted mix of page loads, API reads and streamed
+# chats against its own project until the duration is up. Pool usage is
+# sampled from /metrics while the load runs.
+#
+#     python -m bench.loadgen --base-url http://127.0.0.1:5000 --users 20 --duration 60 \
+#         --username bench{n} --password bench
+
+DEFAULT_MIX = {'projects_page': 3, 'projects_api': 3, 'project_details': 3, 'chat': 1}
+POOL_GAUGES = ('db_pool_size', 'db_pool_checked_out', 'db_pool_overflow')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.first_token = []
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def record_first_token(self, seconds):
+        with self._lock:
+            self.first_token.append(seconds)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, base_url, username, password, recorder, deadline, mix, role_id):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.recorder = recorder
+        self.deadline = deadline
+        self.mix = mix
+        self.role_id = role_id
+        self.http = requests.Session()
+        self.project_id = None
+
+    def timed(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=300, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record(route, time.perf_counter() - started, ok)
+        return response
+
+    def run(self):
+        response = self.timed('login', 'POST', '/', json={'username': self.username, 'password': self.password})
+        if response is None or response.status_code != 200:
+            return
+        response = self.http.get(self.base_url + '/api/projects', timeout=30)
+        projects = response.json().get('projects') if response.ok else None
+        if not projects:
+            return
+        self.project_id = projects[0]['id']
+
+        routes, weights = zip(*self.mix.items())
+        while time.monotonic() < self.deadline:
+            getattr(self, random.choices(routes, weights)[0])()
+
+    def projects_page(self):
+        self.timed('projects_page', 'GET', '/projects')
+
+    def projects_api(self):
+        self.timed('projects_api', 'GET', '/api/projects')
+
+    def project_details(self):
+        self.timed('project_details', 'GET', f'/api/project/{self.project_id}/details')
+
+    def chat(self):
+        started = time.perf_counter()
+        ok = False
+        try:
+            payload = {'message': f'Benchmark question {random.randint(1, 10 ** 6)}'}
+            if self.role_id:
+                payload['role_id'] = self.role_id
+            with self.http.post(f'{self.base_url}/api/project/{self.project_id}/chat', json=payload,
+                                stream=True, timeout=300) as response:
+                first_token = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if first_token is None and line.startswith('data:') and '"token"' in line:
+                        first_token = time.perf_counter() - started
+                        self.recorder.record_first_token(first_token)
+                    if line.startswith('event: done'):
+                        ok = True
+                    if line.startswith('event: error'):
+                        break
+        except requests.RequestException:
+            pass
+        self.recorder.record('chat', time.perf_counter() - started, ok)
+
+
+def scrape_metrics(base_url):
+    try:
+        text = requests.get(f'{base_url}/metrics', timeout=5).text
+    except requests.RequestException:
+        return {}
+    values = {}
+    for name in POOL_GAUGES + ('db_pool_checkouts_total', 'db_pool_connections_created_total'):
+        match = re.search(rf'^{name} (\S+)$', text, re.MULTILINE)
+        if match:
+            values[name] = float(match.group(1))
+    return values
+
+
+def sample_pool(base_url, deadline, samples):
+    while time.monotonic() < deadline:
+        values = scrape_metrics(base_url)
+        if values:
+            samples.append(values)
+        time.sleep(1)
+
+
+def run_load(base_url, users, duration, username, password, mix=None, role_id=None):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    pool_samples = []
+    sampler = threading.Thread(target=sample_pool, args=(base_url, deadline, pool_samples), daemon=True)
+    virtual_users = [
+        VirtualUser(base_url, username.format(n=n), password, recorder, deadline, mix or DEFAULT_MIX, role_id)
+        for n in range(users)
+    ]
+    started = time.perf_counter()
+    sampler.start()
+    for user in virtual_users:
+        user.start()
+    for user in virtual_users:
+        user.join()
+    elapsed = time.perf_counter() - started
+    sampler.join(timeout=5)
+    return build_report(recorder, elapsed, users, pool_samples, scrape_metrics(base_url))
+
+
+def build_report(recorder, elapsed, users, pool_samples, final_metrics):
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': recorder.errors[route],
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1),
+        }
+    report = {
+        'users': users,
+        'elapsed_seconds': round(elapsed, 1),
+        'total_rps': round(sum(len(values) for values in recorder.latencies.values()) / elapsed, 2),
+        'routes': routes,
+        # The backend's metrics are per process; with several workers these
+        # samples come from whichever worker answered the scrape
+        'pool': {
+            'peak_checked_out': max((sample.get('db_pool_checked_out', 0) for sample in pool_samples), default=None),
+            'peak_overflow': max((sample.get('db_pool_overflow', 0) for sample in pool_samples), default=None),
+            'final': final_metrics,
+        },
+    }
+    if recorder.first_token:
+        report['chat_first_token'] = {
+            'p50_ms': round(percentile(recorder.first_token, 0.5) * 1000, 1),
+            'p99_ms': round(percentile(recorder.first_token, 0.99) * 1000, 1),
+        }
+    return report
+
+
+def format_report(report, baseline=None):
+    lines = [f"{report['users']} users, {report['elapsed_seconds']}s, {report['total_rps']} req/s total", '']
+    header = f"{'route':<18}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    if baseline:
+        header += f"{'p50 Δ':>10}{'p99 Δ':>10}"
+    lines.append(header)
+    for route, stats in report['routes'].items():
+        line = (f"{route:<18}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+                f"{stats['p50_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before:
+            line += f"{stats['p50_ms'] - before['p50_ms']:>+10.1f}{stats['p99_ms'] - before['p99_ms']:>+10.1f}"
+        lines.append(line)
+    if 'chat_first_token' in report:
+        lines.append('')
+        lines.append(f"chat first token: p50 {report['chat_first_token']['p50_ms']} ms, "
+                     f"p99 {report['chat_first_token']['p99_ms']} ms")
+    pool = report['pool']
+    lines.append('')
+    lines.append(f"db pool: peak checked out {pool['peak_checked_out']}, peak overflow {pool['peak_overflow']}, "
+                 f"size {pool['final'].get('db_pool_size')}, checkouts {pool['final'].get('db_pool_checkouts_total')}")
+    return '\n'.join(lines)
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        route, weight = item.split(':')
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f'Unknown route {route}; choose from {", ".join(DEFAULT_MIX)}')
+        mix[route] = float(weight)
+    return mix
+
+
+def add_load_arguments(parser):
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help='route weights, e.g. projects_page:3,projects_api:3,project_details:3,chat:1')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+
+
+def write_report(report, args):
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the Idea Incubator backend')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--username', default='bench{n}', help='login name; {n} is replaced by the user number')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--role-id', type=int, help='role to chat with (defaults to the planner role)')
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    report = run_load(args.base_url, args.users, args.duration, args.username, args.password, args.mix, args.role_id)
+    write_report(report, args)
+
+
+if __name__ == '__main__':
+    main()
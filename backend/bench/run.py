@@ -0,0 +1,127 @@
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from bench.loadgen import add_load_arguments, run_load, write_report
+from bench.stub_ollama import start_stub
+
+# One-shot benchmark: prepares a database, starts the stub LLM and the
+# backend, runs the load generator and prints the report. Run it from the
+# backend directory, before and after a change, and compare:
+#
+#     python -m bench.run --users 20 --duration 60 --output before.json
+#     python -m bench.run --users 20 --duration 60 --baseline before.json
+#
+# DATABASE_URL selects the database (a local SQLite file by default). Use a
+# dedicated database: the bench users, their projects and provider settings
+# are created in it, and roles without a model are pointed at the stub.
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(BACKEND_DIR, 'bench', 'bench.db')}"
+STUB_MODEL = 'stub-model'
+
+
+def seed(users, password, stub_url):
+    # Imported here so that DATABASE_URL is set before the app reads it
+    from app import app, db
+    from migrate import run_migrations
+    from models import Project, ProviderSettings, Role, User
+    from passwords import hasher
+    from role_prompts import ROLE_PROMPTS
+    import lookup_cache
+
+    run_migrations()
+    with app.app_context():
+        for name, data in ROLE_PROMPTS.items():
+            role = Role.query.filter_by(name=name).first()
+            if not role:
+                role = Role(name=name, system_prompt=data['prompt'], temperature=data['temperature'])
+                db.session.add(role)
+            if not role.model:
+                role.model = STUB_MODEL
+
+        password_hash = hasher.hash(password)
+        for n in range(users):
+            username = f'bench{n}'
+            user = User.query.filter_by(username=username).first()
+            if not user:
+                user = User(username=username, email=f'{username}@bench.invalid', password=password_hash)
+                db.session.add(user)
+                db.session.flush()
+            settings = ProviderSettings.query.filter_by(user_id=user.id).first()
+            if not settings:
+                settings = ProviderSettings(user_id=user.id, provider_name='Ollama')
+                db.session.add(settings)
+            settings.ollama_url = stub_url
+            if not Project.query.filter_by(user_id=user.id).first():
+                db.session.add(Project(name=f'Bench project {n}', user_id=user.id,
+                                       description='A project used by the load test. ' * 20))
+        lookup_cache.bump(lookup_cache.ROLE, lookup_cache.PROVIDER_SETTINGS)
+        db.session.commit()
+
+
+def start_server(kind, port, env):
+    if kind == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app']
+        env['GUNICORN_BIND'] = f'127.0.0.1:{port}'
+    else:
+        if port != 5000:
+            raise SystemExit('The development server always listens on port 5000')
+        command = [sys.executable, 'app.py']
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+
+
+def wait_until_up(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'Backend exited with status {process.returncode}')
+        try:
+            requests.get(f'{base_url}/login', timeout=2, allow_redirects=False)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise SystemExit('Backend did not come up in time')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the backend against a stub LLM under load')
+    parser.add_argument('--server', choices=['gunicorn', 'dev'],
+                        default='gunicorn' if importlib.util.find_spec('gunicorn') else 'dev')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--stub-port', type=int, default=11500)
+    parser.add_argument('--ttft', type=float, default=0.3, help='stub seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=40.0)
+    parser.add_argument('--tokens', type=int, default=120, help='stub tokens per reply')
+    parser.add_argument('--password', default='bench')
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', DEFAULT_DATABASE_URL)
+    os.environ.setdefault('EMBEDDING_INDEX_DIR', tempfile.mkdtemp(prefix='bench-embeddings-'))
+    stub = start_stub(args.stub_port, args.ttft, args.tokens_per_second, args.tokens, [STUB_MODEL])
+    stub_url = f'http://127.0.0.1:{args.stub_port}'
+    seed(args.users, args.password, stub_url)
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    process = start_server(args.server, args.port, dict(os.environ))
+    try:
+        wait_until_up(base_url, process)
+        report = run_load(base_url, args.users, args.duration, 'bench{n}', args.password, args.mix)
+        report['server'] = args.server
+        report['database'] = os.environ['DATABASE_URL'].split(':', 1)[0]
+        write_report(report, args)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
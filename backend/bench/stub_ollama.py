@@ -0,0 +1,148 @@
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ollama-compatible stub for load tests without a GPU. It answers the calls
+# the backend makes (/api/generate streaming and not, /api/embed, /api/tags,
+# /api/ps) and paces generated tokens to a configured time to first token and
+# token rate:
+#
+#     python -m bench.stub_ollama --port 11500 --ttft 0.3 --tokens-per-second 40 --tokens 120
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'StubOllama/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': name} for name in self.server.models]})
+        elif self.path == '/api/ps':
+            self._send_json({'models': [{'name': name} for name in self.server.models]})
+        elif self.path == '/api/version':
+            self._send_json({'version': 'stub'})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json({'error': 'invalid JSON'}, status=400)
+            return
+        if self.path == '/api/generate':
+            self._generate(body)
+        elif self.path == '/api/embed':
+            inputs = body.get('input') or []
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({'model': body.get('model'), 'embeddings': [self._embedding(text) for text in inputs]})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def _generate(self, body):
+        model = body.get('model')
+        prompt = body.get('prompt')
+        if not prompt:
+            # Model load / keep-alive request
+            self._send_json({'model': model, 'response': '', 'done': True, 'done_reason': 'load'})
+            return
+
+        started = time.perf_counter()
+        words = [f'token{i}' for i in range(self.server.tokens)]
+        interval = 1 / self.server.tokens_per_second if self.server.tokens_per_second > 0 else 0
+        final = {
+            'model': model, 'response': '', 'done': True, 'done_reason': 'stop',
+            'context': list(range(min(len(prompt) // 4, 2048))),
+            'prompt_eval_count': len(prompt) // 4,
+            'prompt_eval_duration': int(self.server.ttft * 1e9),
+            'eval_count': len(words),
+            'eval_duration': int(len(words) * interval * 1e9),
+        }
+        time.sleep(self.server.ttft)
+
+        if body.get('stream') is False:
+            time.sleep(len(words) * interval)
+            final['response'] = ' '.join(words)
+            final['total_duration'] = int((time.perf_counter() - started) * 1e9)
+            self._send_json(final)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for word in words:
+                self._write_chunk({'model': model, 'response': word + ' ', 'done': False})
+                time.sleep(interval)
+            final['total_duration'] = int((time.perf_counter() - started) * 1e9)
+            self._write_chunk(final)
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _embedding(self, text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return [byte / 255 for byte in digest[:self.server.embedding_dim]]
+
+    def _write_chunk(self, obj):
+        data = (json.dumps(obj) + '\n').encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream is normal under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub(port=11500, ttft=0.3, tokens_per_second=40.0, tokens=120, models=('stub-model',), embedding_dim=32):
+    server = StubOllamaServer(('127.0.0.1', port), StubOllamaHandler)
+    server.ttft = ttft
+    server.tokens_per_second = tokens_per_second
+    server.tokens = tokens
+    server.models = list(models)
+    server.embedding_dim = embedding_dim
+    threading.Thread(target=server.serve_forever, name='stub-ollama', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ollama-compatible stub server for benchmarks')
+    parser.add_argument('--port', type=int, default=11500)
+    parser.add_argument('--ttft', type=float, default=0.3, help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=40.0)
+    parser.add_argument('--tokens', type=int, default=120, help='tokens per reply')
+    parser.add_argument('--models', default='stub-model', help='comma-separated model names to advertise')
+    args = parser.parse_args()
+    server = start_stub(args.port, args.ttft, args.tokens_per_second, args.tokens, args.models.split(','))
+    print(f"Stub Ollama listening on http://127.0.0.1:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
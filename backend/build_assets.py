@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fingerprints and precompresses the files in static/ for production. Run it
+# after changing any asset (the Docker image runs it at build time):
+#
+#     python build_assets.py
+#
+# Each file is copied to static/dist/ with a hash of its content in the name
+# (css/base.css -> css/base.3f2a9c1e07b4.css), next to .br and .gz variants
+# where compression pays off. static/dist/manifest.json maps the original
+# names to the hashed ones for asset_url() in the templates. Only the standard
+# library is needed here; brotli variants are skipped if Brotli is missing.
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.json', '.map', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf'}
+MIN_COMPRESS_BYTES = 256
+HASH_LENGTH = 12
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    # The new tree is written beside the old one and swapped in at the end,
+    # so a running server never sees a half-built dist/
+    staging = dist_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) not in (dist_dir, staging))
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(relative)
+            hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}'
+            target = os.path.join(staging, hashed)
+            _write(target, data)
+
+            encodings = []
+            if ext.lower() in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+                variants = [('gzip', '.gz', lambda: gzip.compress(data, 9, mtime=0))]
+                if brotli is not None:
+                    variants.insert(0, ('br', '.br', lambda: brotli.compress(data, quality=11)))
+                for encoding, suffix, compress in variants:
+                    compressed = compress()
+                    if len(compressed) < len(data):
+                        _write(target + suffix, compressed)
+                        encodings.append(encoding)
+            manifest[relative] = {'path': hashed, 'encodings': encodings}
+
+    _write(os.path.join(staging, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    old = dist_dir + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(dist_dir):
+        os.rename(dist_dir, old)
+    os.rename(staging, dist_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    manifest = build()
+    compressed = sum(1 for entry in manifest.values() if entry['encodings'])
+    print(f'Built {len(manifest)} assets into {DIST_DIR} ({compressed} precompressed'
+          f'{", no brotli" if brotli is None else ""})', file=sys.stderr)
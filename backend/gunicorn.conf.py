@@ -0,0 +1,52 @@
+import multiprocessing
+import os
+import time
+
+# Production server: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# The app is loaded once in the master (checking the schema there) and forked
+# into WEB_CONCURRENCY workers. The default gthread workers serve each request
+# on a thread; GUNICORN_WORKER_CLASS=gevent serves many long-running LLM
+# streams per worker on greenlets instead.
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+# Exported so that app.py can split DB_MAX_CONNECTIONS between the workers
+workers = int(os.environ.setdefault('WEB_CONCURRENCY', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '200'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+preload_app = True
+accesslog = None  # request_logging.py writes the access log
+
+if worker_class == 'gevent':
+    # Patch before the preloaded app imports socket, ssl and threading
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+
+def on_starting(server):
+    from app import app, db, prepare_database
+    prepare_database()
+    with app.app_context():
+        db.engine.dispose()
+
+
+def when_ready(server):
+    from app import BOOT_STARTED
+    server.log.info("Ready in %.2fs with %s %s workers", time.perf_counter() - BOOT_STARTED, workers, worker_class)
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared with the workers;
+    # close=False leaves them for the master instead of closing them under it
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
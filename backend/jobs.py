@@ -0,0 +1,171 @@
+import time
+from datetime import datetime, timedelta
+
+from admission import BACKGROUND, AdmissionRejected, request_cost, scheduler
+from app import app, db
+from models import AgentJob, ProviderSettings, Role
+from ollama_client import ollama_base_urls, stream_generate
+from web_search import format_results as format_web_results, web_search, with_web_results
+
+# Long-running agent tasks are queued in the agent_job table and executed by
+# worker.py. Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED, so any
+# number of them can poll the same table without handing out a job twice.
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+
+def new_job(user_id, project_id, role, prompt, workflow_stage_id=None):
+    return AgentJob(
+        user_id=user_id,
+        project_id=project_id,
+        role_id=role.id,
+        workflow_stage_id=workflow_stage_id,
+        model=role.model,
+        prompt=prompt,
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+    )
+
+
+def submit_job(user_id, project_id, role, prompt):
+    job = new_job(user_id, project_id, role, prompt)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def claim_job(worker_id, exclude_models=()):
+    query = AgentJob.query.filter(AgentJob.status == 'queued', AgentJob.run_after <= datetime.utcnow())
+    if exclude_models:
+        query = query.filter(AgentJob.model.notin_(exclude_models))
+    job = query.order_by(AgentJob.id).with_for_update(skip_locked=True).first()
+    if not job:
+        db.session.rollback()
+        return None
+    # The status guard keeps this safe on databases without row locks (SQLite)
+    claimed = db.session.execute(
+        db.update(AgentJob)
+        .where(AgentJob.id == job.id, AgentJob.status == 'queued')
+        .values(status='running', locked_by=worker_id, locked_at=datetime.utcnow(),
+                attempts=AgentJob.attempts + 1, updated_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return db.session.get(AgentJob, job.id) if claimed else None
+
+
+def requeue_stale_jobs():
+    # Jobs whose worker died mid-run go back on the queue, unless that used
+    # up their attempts, so a job that keeps crashing its worker fails
+    now = datetime.utcnow()
+    stale = db.and_(AgentJob.status == 'running',
+                    AgentJob.locked_at < now - timedelta(seconds=app.config['JOB_LOCK_TIMEOUT']))
+    count = db.session.execute(
+        db.update(AgentJob)
+        .where(stale, AgentJob.attempts < AgentJob.max_attempts)
+        .values(status='queued', locked_by=None, locked_at=None, updated_at=now)
+    ).rowcount
+    exhausted = db.session.scalars(db.select(AgentJob.id).where(stale)).all()
+    if exhausted:
+        db.session.execute(
+            db.update(AgentJob)
+            .where(stale, AgentJob.id.in_(exhausted))
+            .values(status='failed', error='The worker running this job stopped on every attempt',
+                    locked_by=None, locked_at=None, updated_at=now)
+        )
+    db.session.commit()
+    if count:
+        app.logger.warning("Requeued %d stale agent job(s)", count)
+    if exhausted:
+        app.logger.error("Agent job(s) %s failed: worker stopped on every attempt", exhausted)
+        import workflows
+        for job in AgentJob.query.filter(AgentJob.id.in_(exhausted), AgentJob.workflow_stage_id.isnot(None)):
+            workflows.stage_failed(job)
+    return count
+
+
+def stub_generate(base_urls, model, prompt, system=None, temperature=None, user_id=None, priority=None,
+                  role_id=None):
+    # Stand-in for stream_generate when running workers without an LLM
+    for word in f'[{model}] {prompt}'.split():
+        time.sleep(0.01)
+        yield {'response': f'{word} ', 'done': False}
+    yield {'response': '', 'done': True, 'done_reason': 'stop'}
+
+
+def run_job(job, generate=stream_generate):
+    role = db.session.get(Role, job.role_id) if job.role_id else None
+    provider_settings = ProviderSettings.query.filter_by(user_id=job.user_id).first()
+    base_urls = ollama_base_urls(provider_settings.ollama_url) if provider_settings else []
+
+    system = role.system_prompt if role else None
+    prompt = job.prompt
+    if role and role.web_search:
+        prompt = with_web_results(prompt, format_web_results(web_search.search(job.prompt)))
+    try:
+        scheduler.admit(job.user_id, request_cost(prompt, system))
+    except AdmissionRejected as e:
+        _defer_job(job, e.retry_after)
+        return job
+
+    tokens = []
+    last_flush = time.monotonic()
+    try:
+        chunks = generate(base_urls, job.model, prompt, system=system,
+                          temperature=role.temperature if role else None,
+                          user_id=job.user_id, priority=BACKGROUND, role_id=job.role_id)
+        for chunk in chunks:
+            if chunk.get('response'):
+                tokens.append(chunk['response'])
+            # Progress is written at most once a second to keep the row cool
+            if time.monotonic() - last_flush >= 1:
+                job.progress = ''.join(tokens)
+                job.locked_at = datetime.utcnow()
+                db.session.commit()
+                last_flush = time.monotonic()
+    except Exception as e:
+        db.session.rollback()
+        _fail_job(job, ''.join(tokens), e)
+        return job
+
+    from routes import get_or_create_conversation, save_chat_turns
+    job.progress = job.result = ''.join(tokens)
+    job.status = 'succeeded'
+    job.error = None
+    job.locked_by = job.locked_at = None
+    if job.workflow_stage_id:
+        import workflows
+        workflows.stage_succeeded(job)
+    elif job.role_id:
+        conversation = get_or_create_conversation(job.project_id, job.role_id)
+        save_chat_turns(job.project_id, job.prompt, [(conversation.id, job.result)])
+    else:
+        db.session.commit()
+    return job
+
+
+def _defer_job(job, delay):
+    # The user is out of LLM budget; this does not count as a failed attempt
+    job.status = 'queued'
+    job.attempts -= 1
+    job.locked_by = job.locked_at = None
+    job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+    app.logger.info("Agent job %s deferred %.1fs by admission control", job.id, delay)
+    db.session.commit()
+
+
+def _fail_job(job, partial, error):
+    job.progress = partial
+    job.error = str(error)
+    job.locked_by = job.locked_at = None
+    if job.attempts < job.max_attempts:
+        # Exponential backoff: 1x, 2x, 4x ... the base delay
+        delay = app.config['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1)
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+        app.logger.warning("Agent job %s attempt %s failed, retrying in %.0fs: %s", job.id, job.attempts, delay, error)
+    else:
+        job.status = 'failed'
+        app.logger.error("Agent job %s failed after %s attempts: %s", job.id, job.attempts, error)
+    db.session.commit()
+    if job.status == 'failed' and job.workflow_stage_id:
+        import workflows
+        workflows.stage_failed(job)
@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta
+
+from app import app, db
+from models import LoginFailure
+
+# Limits failed login attempts per username and per client address over a
+# sliding window. Failures are rows in login_failure, so the limits hold
+# across every worker process and survive restarts. Rows older than the
+# window are deleted now and then by whichever process records a failure.
+
+
+class LoginThrottle:
+    def __init__(self):
+        self._engine = None
+        self._last_prune = 0
+
+    @property
+    def engine(self):
+        # Own short transactions, outside the request's session
+        if self._engine is None:
+            with app.app_context():
+                self._engine = db.engine
+        return self._engine
+
+    @staticmethod
+    def _keys(username, address):
+        keys = [(f'user:{username}'[:255], app.config['LOGIN_MAX_ATTEMPTS_PER_USER'])]
+        if address:
+            keys.append((f'ip:{address}'[:255], app.config['LOGIN_MAX_ATTEMPTS_PER_IP']))
+        return keys
+
+    def retry_after(self, username, address):
+        # Seconds until another attempt is allowed, or 0 when not throttled
+        now = datetime.utcnow()
+        window = timedelta(seconds=app.config['LOGIN_THROTTLE_WINDOW'])
+        failures = LoginFailure.__table__
+        wait = 0
+        with self.engine.connect() as conn:
+            for key, limit in self._keys(username, address):
+                count, oldest = conn.execute(
+                    db.select(db.func.count(), db.func.min(failures.c.failed_at))
+                    .where(failures.c.key == key, failures.c.failed_at > now - window)
+                ).one()
+                if count >= limit:
+                    wait = max(wait, (oldest + window - now).total_seconds())
+        return wait
+
+    def record_failure(self, username, address):
+        now = datetime.utcnow()
+        failures = LoginFailure.__table__
+        with self.engine.begin() as conn:
+            conn.execute(db.insert(failures), [{'key': key, 'failed_at': now}
+                                               for key, _ in self._keys(username, address)])
+        self._maybe_prune()
+
+    def record_success(self, username):
+        failures = LoginFailure.__table__
+        with self.engine.begin() as conn:
+            conn.execute(db.delete(failures).where(failures.c.key == f'user:{username}'[:255]))
+
+    def _maybe_prune(self):
+        window = app.config['LOGIN_THROTTLE_WINDOW']
+        if time.monotonic() - self._last_prune < window:
+            return
+        self._last_prune = time.monotonic()
+        failures = LoginFailure.__table__
+        with self.engine.begin() as conn:
+            conn.execute(db.delete(failures).where(failures.c.failed_at < datetime.utcnow() - timedelta(seconds=window)))
+
+
+throttle = LoginThrottle()
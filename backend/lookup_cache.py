@@ -0,0 +1,101 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import CacheVersion, ProviderSettings, Role
+
+# In-process cache for Role and ProviderSettings rows. These rows change only
+# through the settings pages, so every worker keeps plain snapshots of them and
+# drops a namespace as soon as its row in cache_version has moved on. Writers
+# call bump() before committing.
+
+ROLE = 'role'
+PROVIDER_SETTINGS = 'provider_settings'
+
+_MISSING = object()
+_lock = threading.Lock()
+_entries = {}
+_versions = {}
+_last_check = 0.0
+
+
+def _sync_versions():
+    global _last_check
+    now = time.monotonic()
+    if now - _last_check < app.config['CACHE_VERSION_CHECK_INTERVAL']:
+        return
+    versions = dict(db.session.query(CacheVersion.name, CacheVersion.version).all())
+    with _lock:
+        for namespace in (ROLE, PROVIDER_SETTINGS):
+            version = versions.get(namespace, 0)
+            if _versions.get(namespace) != version:
+                _versions[namespace] = version
+                for key in [key for key in _entries if key[0] == namespace]:
+                    del _entries[key]
+        _last_check = now
+
+
+def _cached(namespace, key, load):
+    _sync_versions()
+    with _lock:
+        value = _entries.get((namespace, key), _MISSING)
+    if value is _MISSING:
+        value = load()
+        with _lock:
+            _entries[(namespace, key)] = value
+    return value
+
+
+def _snapshot(row):
+    # Detached, read-only copy that is safe to share between requests
+    return SimpleNamespace(**row.to_dict()) if row else None
+
+
+def get_role(role_id):
+    # None for ids that are not integers, like any other unknown role
+    try:
+        role_id = int(role_id)
+    except (TypeError, ValueError):
+        return None
+    return _cached(ROLE, ('id', role_id), lambda: _snapshot(Role.query.get(role_id)))
+
+
+def get_role_by_name(name):
+    return _cached(ROLE, ('name', name), lambda: _snapshot(Role.query.filter_by(name=name).first()))
+
+
+def get_all_roles():
+    return _cached(ROLE, ('all',), lambda: [_snapshot(role) for role in Role.query.order_by(Role.id).all()])
+
+
+def get_provider_settings(user_id):
+    return _cached(PROVIDER_SETTINGS, ('user', user_id),
+                   lambda: _snapshot(ProviderSettings.query.filter_by(user_id=user_id).first()))
+
+
+def _increment(namespace):
+    return db.session.execute(
+        db.update(CacheVersion)
+        .where(CacheVersion.name == namespace)
+        .values(version=CacheVersion.version + 1)
+    ).rowcount
+
+
+def bump(*namespaces):
+    global _last_check
+    for namespace in namespaces:
+        if _increment(namespace) == 0:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(CacheVersion(name=namespace, version=1))
+            except IntegrityError:
+                # Another worker created the row first; bump theirs instead
+                _increment(namespace)
+    with _lock:
+        for key in [key for key in _entries if key[0] in namespaces]:
+            del _entries[key]
+        # Re-read the counters on the next lookup instead of waiting out the interval
+        _last_check = 0.0
@@ -0,0 +1,162 @@
+import bisect
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from app import app, db
+
+# In-process request, query and connection-pool metrics, exposed in the
+# Prometheus text format at /metrics. Every worker process keeps its own
+# numbers; scrape each worker (or sum them) when running several.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+RECENT_SAMPLES = 1024
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        # Recent observations for p50/p95/p99; bucket counts alone are too coarse
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self):
+        samples = sorted(self.recent)
+        if not samples:
+            return {}
+        return {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.queue_wait = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.counters = defaultdict(int)
+
+    def observe_request(self, endpoint, method, status, duration, query_count):
+        with self._lock:
+            self.latency[(endpoint, method)].observe(duration)
+            self.queries[(endpoint, method)].observe(query_count)
+            self.counters[('http_requests_total', endpoint, method, f'{status // 100}xx')] += 1
+
+    def observe_queue_wait(self, lane, seconds):
+        with self._lock:
+            self.queue_wait[(lane,)].observe(seconds)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[(name,)] += amount
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# TYPE http_requests_total counter')
+            for key, value in sorted(self.counters.items()):
+                if key[0] == 'http_requests_total':
+                    _, endpoint, method, status = key
+                    lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {value}')
+            _render_histograms(lines, 'http_request_duration_seconds', self.latency)
+            _render_histograms(lines, 'http_request_db_queries', self.queries)
+            _render_histograms(lines, 'llm_queue_wait_seconds', self.queue_wait, ('lane',))
+            for key, value in sorted(self.counters.items()):
+                if key[0] != 'http_requests_total':
+                    lines.append(f'# TYPE {key[0]} counter')
+                    lines.append(f'{key[0]} {value}')
+        _render_pool(lines)
+        return '\n'.join(lines) + '\n'
+
+
+def _render_histograms(lines, name, histograms, label_names=('endpoint', 'method')):
+    lines.append(f'# TYPE {name} histogram')
+    for key, histogram in sorted(histograms.items()):
+        labels = ','.join(f'{label}="{value}"' for label, value in zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    lines.append(f'# TYPE {name}_recent gauge')
+    for key, histogram in sorted(histograms.items()):
+        labels = ','.join(f'{label}="{value}"' for label, value in zip(label_names, key))
+        for q, value in histogram.quantiles().items():
+            lines.append(f'{name}_recent{{{labels},quantile="{q}"}} {value:.6f}')
+
+
+def _render_pool(lines):
+    with app.app_context():
+        pool = db.engine.pool
+    gauges = {}
+    for name, method in (('size', 'size'), ('checked_out', 'checkedout'), ('checked_in', 'checkedin'),
+                         ('overflow', 'overflow')):
+        if hasattr(pool, method):
+            gauges[name] = getattr(pool, method)()
+    if 'overflow' in gauges:
+        # QueuePool reports overflow relative to pool_size, i.e. negative while under it
+        gauges['overflow'] = max(gauges['overflow'], 0)
+    for name, value in gauges.items():
+        lines.append(f'# TYPE db_pool_{name} gauge')
+        lines.append(f'db_pool_{name} {value}')
+    lines.append('# TYPE db_pool_max_overflow gauge')
+    lines.append(f"db_pool_max_overflow {getattr(pool, '_max_overflow', 0)}")
+
+
+registry = Registry()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and g.get('query_count') is not None:
+        g.query_count += 1
+
+
+@event.listens_for(Pool, 'connect')
+def _count_connect(dbapi_connection, connection_record):
+    registry.increment('db_pool_connections_created_total')
+
+
+@event.listens_for(Pool, 'checkout')
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    registry.increment('db_pool_checkouts_total')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    state = g._get_current_object()
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method
+    status = response.status_code
+
+    # Streamed responses keep running after this hook, so record on close
+    def record():
+        registry.observe_request(endpoint, method, status, time.perf_counter() - started, state.get('query_count', 0))
+
+    response.call_on_close(record)
+    return response
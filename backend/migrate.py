@@ -0,0 +1,31 @@
+import time
+
+from flask_migrate import upgrade
+
+from app import DELETE_DB_ON_STARTUP, app, db, delete_all_tables
+from schema import MIGRATIONS_DIR, check_schema, wait_for_database
+
+# Brings the database schema up to date, then exits. Run it once per deploy
+# before starting the web and worker processes:
+#
+#     python migrate.py
+
+
+def run_migrations():
+    started = time.perf_counter()
+    wait_for_database()
+    with app.app_context():
+        if DELETE_DB_ON_STARTUP:
+            delete_all_tables()
+        # The first migration alters tables that only create_all makes, and
+        # every migration skips changes that are already present
+        db.create_all()
+        upgrade(directory=MIGRATIONS_DIR)
+    ok, current, expected = check_schema()
+    if not ok:
+        raise SystemExit(f"Schema is at {sorted(current)} after upgrade, expected {sorted(expected)}")
+    print(f"Database schema is at {', '.join(sorted(current))} ({time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == '__main__':
+    run_migrations()
@@ -0,0 +1,27 @@
+"""Add cache_responses column to role table
+
+Revision ID: add_cache_responses_to_role
+Revises: add_cache_version
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_cache_responses_to_role'
+down_revision = 'add_cache_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = inspector.get_columns('role')
+    if 'cache_responses' not in [col['name'] for col in columns]:
+        op.add_column('role', sa.Column('cache_responses', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('role', 'cache_responses')
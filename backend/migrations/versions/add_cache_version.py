@@ -0,0 +1,30 @@
+"""Add cache_version table for cross-worker cache invalidation
+
+Revision ID: add_cache_version
+Revises: add_conversation_history
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_cache_version'
+down_revision = 'add_conversation_history'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if 'cache_version' not in inspector.get_table_names():
+        op.create_table(
+            'cache_version',
+            sa.Column('name', sa.String(50), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+        )
+
+
+def downgrade():
+    op.drop_table('cache_version')
@@ -0,0 +1,42 @@
+"""Add prompt context and summary columns to conversation
+
+Revision ID: add_conversation_context
+Revises: add_agent_job
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_conversation_context'
+down_revision = 'add_agent_job'
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = [
+    ('context', sa.Text()),
+    ('context_model', sa.String(100)),
+    ('context_message_id', sa.Integer()),
+    ('summary', sa.Text()),
+    ('summary_message_id', sa.Integer()),
+]
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = [col['name'] for col in inspector.get_columns('conversation')]
+    for name, type_ in NEW_COLUMNS:
+        if name not in existing:
+            op.add_column('conversation', sa.Column(name, type_, nullable=True))
+
+    indexes = [index['name'] for index in inspector.get_indexes('message')]
+    if 'ix_message_conversation_id_id' not in indexes:
+        op.create_index('ix_message_conversation_id_id', 'message', ['conversation_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_message_conversation_id_id', table_name='message')
+    for name, _ in reversed(NEW_COLUMNS):
+        op.drop_column('conversation', name)
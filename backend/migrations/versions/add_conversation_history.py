@@ -0,0 +1,48 @@
+"""Add conversation and message tables for chat history
+
+Revision ID: add_conversation_history
+Revises: add_temperature_to_role
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_conversation_history'
+down_revision = 'add_temperature_to_role'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    tables = inspector.get_table_names()
+
+    if 'conversation' not in tables:
+        op.create_table(
+            'conversation',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('project_id', sa.Integer(), sa.ForeignKey('project.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('role_id', sa.Integer(), sa.ForeignKey('role.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_conversation_project_id', 'conversation', ['project_id'])
+
+    if 'message' not in tables:
+        op.create_table(
+            'message',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('conversation_id', sa.Integer(), sa.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('project_id', sa.Integer(), sa.ForeignKey('project.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('sender', sa.String(20), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_message_project_id_id', 'message', ['project_id', 'id'])
+
+
+def downgrade():
+    op.drop_table('message')
+    op.drop_table('conversation')
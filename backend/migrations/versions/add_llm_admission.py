@@ -0,0 +1,49 @@
+"""Add tables for LLM admission control
+
+Revision ID: add_llm_admission
+Revises: add_search_index
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_llm_admission'
+down_revision = 'add_search_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    tables = sa.inspect(conn).get_table_names()
+    if 'llm_token_bucket' not in tables:
+        op.create_table(
+            'llm_token_bucket',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('tokens', sa.Float(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+    if 'llm_backend' not in tables:
+        op.create_table(
+            'llm_backend',
+            sa.Column('url', sa.String(255), primary_key=True),
+            sa.Column('locked_at', sa.DateTime(), nullable=True),
+        )
+    if 'llm_lease' not in tables:
+        op.create_table(
+            'llm_lease',
+            sa.Column('id', sa.String(32), primary_key=True),
+            sa.Column('url', sa.String(255), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('priority', sa.Integer(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_llm_lease_url_expires_at', 'llm_lease', ['url', 'expires_at'])
+
+
+def downgrade():
+    op.drop_table('llm_lease')
+    op.drop_table('llm_backend')
+    op.drop_table('llm_token_bucket')
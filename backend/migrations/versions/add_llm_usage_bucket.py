@@ -0,0 +1,50 @@
+"""Add llm_usage_bucket table for rolled-up LLM call telemetry
+
+Revision ID: add_llm_usage_bucket
+Revises: add_workflows
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_llm_usage_bucket'
+down_revision = 'add_workflows'
+branch_labels = None
+depends_on = None
+
+SUM_COLUMNS = [
+    ('calls', sa.Integer()),
+    ('errors', sa.Integer()),
+    ('queue_wait_seconds', sa.Float()),
+    ('ttft_seconds', sa.Float()),
+    ('ttft_count', sa.Integer()),
+    ('ttft_max_seconds', sa.Float()),
+    ('prompt_tokens', sa.Integer()),
+    ('prompt_eval_seconds', sa.Float()),
+    ('eval_tokens', sa.Integer()),
+    ('eval_seconds', sa.Float()),
+    ('total_seconds', sa.Float()),
+]
+
+
+def upgrade():
+    conn = op.get_bind()
+    if 'llm_usage_bucket' in sa.inspect(conn).get_table_names():
+        return
+    op.create_table(
+        'llm_usage_bucket',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('role_id', sa.Integer(), nullable=False),
+        sa.Column('model', sa.String(100), nullable=False),
+        sa.Column('host', sa.String(255), nullable=False),
+        *[sa.Column(name, type_, nullable=False) for name, type_ in SUM_COLUMNS],
+        sa.UniqueConstraint('bucket_start', 'role_id', 'model', 'host', name='uq_llm_usage_bucket_key'),
+    )
+    op.create_index('ix_llm_usage_bucket_bucket_start', 'llm_usage_bucket', ['bucket_start'])
+
+
+def downgrade():
+    op.drop_table('llm_usage_bucket')
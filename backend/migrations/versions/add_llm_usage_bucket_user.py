@@ -0,0 +1,36 @@
+"""Add user_id to llm_usage_bucket so telemetry can be shown per user
+
+Revision ID: add_llm_usage_bucket_user
+Revises: add_login_failure
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_llm_usage_bucket_user'
+down_revision = 'add_login_failure'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    columns = {column['name'] for column in sa.inspect(conn).get_columns('llm_usage_bucket')}
+    if 'user_id' in columns:
+        return
+    # Rows recorded before this have no user (0) and are shown to nobody;
+    # batch mode recreates the table on SQLite to change the constraint
+    with op.batch_alter_table('llm_usage_bucket') as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.drop_constraint('uq_llm_usage_bucket_key', type_='unique')
+        batch_op.create_unique_constraint('uq_llm_usage_bucket_key',
+                                          ['bucket_start', 'user_id', 'role_id', 'model', 'host'])
+
+
+def downgrade():
+    with op.batch_alter_table('llm_usage_bucket') as batch_op:
+        batch_op.drop_constraint('uq_llm_usage_bucket_key', type_='unique')
+        batch_op.create_unique_constraint('uq_llm_usage_bucket_key', ['bucket_start', 'role_id', 'model', 'host'])
+        batch_op.drop_column('user_id')
@@ -0,0 +1,33 @@
+"""Add login_failure table for login throttling shared by all processes
+
+Revision ID: add_login_failure
+Revises: add_llm_usage_bucket
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_login_failure'
+down_revision = 'add_llm_usage_bucket'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    if 'login_failure' in sa.inspect(conn).get_table_names():
+        return
+    op.create_table(
+        'login_failure',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('key', sa.String(255), nullable=False),
+        sa.Column('failed_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_login_failure_key_failed_at', 'login_failure', ['key', 'failed_at'])
+    op.create_index('ix_login_failure_failed_at', 'login_failure', ['failed_at'])
+
+
+def downgrade():
+    op.drop_table('login_failure')
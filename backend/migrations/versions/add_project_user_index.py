@@ -0,0 +1,35 @@
+"""Add project user_id index and updated_at column
+
+Revision ID: add_project_user_index
+Revises: add_user_session
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_project_user_index'
+down_revision = 'add_user_session'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = [col['name'] for col in inspector.get_columns('project')]
+    if 'updated_at' not in columns:
+        # A constant default, since SQLite can't add a column defaulting to
+        # CURRENT_TIMESTAMP; existing rows only need some fixed value
+        op.add_column('project', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                           server_default='1970-01-01 00:00:00'))
+
+    indexes = [index['name'] for index in inspector.get_indexes('project')]
+    if 'ix_project_user_id_id' not in indexes:
+        op.create_index('ix_project_user_id_id', 'project', ['user_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_project_user_id_id', table_name='project')
+    op.drop_column('project', 'updated_at')
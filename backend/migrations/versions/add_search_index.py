@@ -0,0 +1,75 @@
+"""Add full-text search indexes for projects and messages
+
+Revision ID: add_search_index
+Revises: add_project_user_index
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_search_index'
+down_revision = 'add_project_user_index'
+branch_labels = None
+depends_on = None
+
+# Postgres keeps a generated tsvector column per table, recomputed on every
+# write and indexed with GIN. Project names weigh more than descriptions.
+POSTGRES_VECTORS = {
+    'project': "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+               "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+    'message': "to_tsvector('english', coalesce(content, ''))",
+}
+
+# SQLite (local and test use) gets external-content FTS5 tables kept in step
+# with the base tables by triggers
+SQLITE_FTS_COLUMNS = {
+    'project': ['name', 'description'],
+    'message': ['content'],
+}
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if conn.dialect.name == 'postgresql':
+        for table, vector in POSTGRES_VECTORS.items():
+            if 'search_vector' not in [col['name'] for col in inspector.get_columns(table)]:
+                op.execute(f"ALTER TABLE {table} ADD COLUMN search_vector tsvector "
+                           f"GENERATED ALWAYS AS ({vector}) STORED")
+            if f'ix_{table}_search_vector' not in [index['name'] for index in inspector.get_indexes(table)]:
+                op.execute(f"CREATE INDEX ix_{table}_search_vector ON {table} USING GIN (search_vector)")
+    elif conn.dialect.name == 'sqlite':
+        existing = inspector.get_table_names()
+        for table, columns in SQLITE_FTS_COLUMNS.items():
+            if f'{table}_fts' in existing:
+                continue
+            column_list = ', '.join(columns)
+            new_values = ', '.join(f'new.{column}' for column in columns)
+            old_values = ', '.join(f'old.{column}' for column in columns)
+            op.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5({column_list}, "
+                       f"content='{table}', content_rowid='id')")
+            op.execute(f"CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts(rowid, {column_list}) VALUES (new.id, {new_values}); END")
+            op.execute(f"CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) "
+                       f"VALUES ('delete', old.id, {old_values}); END")
+            op.execute(f"CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {column_list} ON {table} BEGIN "
+                       f"INSERT INTO {table}_fts({table}_fts, rowid, {column_list}) "
+                       f"VALUES ('delete', old.id, {old_values}); "
+                       f"INSERT INTO {table}_fts(rowid, {column_list}) VALUES (new.id, {new_values}); END")
+            op.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        for table in POSTGRES_VECTORS:
+            op.execute(f"DROP INDEX IF EXISTS ix_{table}_search_vector")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector")
+    elif conn.dialect.name == 'sqlite':
+        for table in SQLITE_FTS_COLUMNS:
+            for event in ('insert', 'delete', 'update'):
+                op.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{event}")
+            op.execute(f"DROP TABLE IF EXISTS {table}_fts")
@@ -0,0 +1,32 @@
+"""Add user_session table for database-backed sessions
+
+Revision ID: add_user_session
+Revises: add_conversation_context
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_user_session'
+down_revision = 'add_conversation_context'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if 'user_session' not in inspector.get_table_names():
+        op.create_table(
+            'user_session',
+            sa.Column('id', sa.String(64), primary_key=True),
+            sa.Column('data', sa.Text(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_user_session_expires_at', 'user_session', ['expires_at'])
+
+
+def downgrade():
+    op.drop_table('user_session')
@@ -0,0 +1,71 @@
+"""Add workflow runs, stages and the stage output cache
+
+Revision ID: add_workflows
+Revises: add_llm_admission
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_workflows'
+down_revision = 'add_llm_admission'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    tables = inspector.get_table_names()
+    if 'workflow_run' not in tables:
+        op.create_table(
+            'workflow_run',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('project_id', sa.Integer(), sa.ForeignKey('project.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('instructions', sa.Text(), nullable=True),
+            sa.Column('status', sa.String(20), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_workflow_run_project_id', 'workflow_run', ['project_id'])
+    if 'workflow_stage' not in tables:
+        op.create_table(
+            'workflow_stage',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('run_id', sa.Integer(), sa.ForeignKey('workflow_run.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('name', sa.String(100), nullable=False),
+            sa.Column('role_id', sa.Integer(), sa.ForeignKey('role.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('depends_on', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(20), nullable=False),
+            sa.Column('cached', sa.Boolean(), nullable=False),
+            sa.Column('input_hash', sa.String(64), nullable=True),
+            sa.Column('job_id', sa.Integer(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+        op.create_index('ix_workflow_stage_run_id', 'workflow_stage', ['run_id'])
+    if 'stage_output' not in tables:
+        op.create_table(
+            'stage_output',
+            sa.Column('input_hash', sa.String(64), primary_key=True),
+            sa.Column('model', sa.String(100), nullable=False),
+            sa.Column('output', sa.Text(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=False),
+        )
+
+    if 'workflow_stage_id' not in [col['name'] for col in inspector.get_columns('agent_job')]:
+        op.add_column('agent_job', sa.Column('workflow_stage_id', sa.Integer(), nullable=True))
+        if conn.dialect.name != 'sqlite':
+            # SQLite cannot add a constraint to an existing table
+            op.create_foreign_key('fk_agent_job_workflow_stage_id', 'agent_job', 'workflow_stage',
+                                  ['workflow_stage_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_column('agent_job', 'workflow_stage_id')
+    op.drop_table('stage_output')
+    op.drop_table('workflow_stage')
+    op.drop_table('workflow_run')
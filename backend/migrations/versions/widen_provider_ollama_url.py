@@ -0,0 +1,25 @@
+"""Widen provider_settings.ollama_url to hold several hosts
+
+Revision ID: widen_provider_ollama_url
+Revises: add_cache_responses_to_role
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'widen_provider_ollama_url'
+down_revision = 'add_cache_responses_to_role'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('provider_settings') as batch_op:
+        batch_op.alter_column('ollama_url', type_=sa.Text(), existing_type=sa.String(200), existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('provider_settings') as batch_op:
+        batch_op.alter_column('ollama_url', type_=sa.String(200), existing_type=sa.Text(), existing_nullable=True)
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+
+from app import app, db
+from models import LlmUsageBucket, ProviderSettings, Role
+from ollama_client import get_session, model_tag, ollama_base_urls, router
+
+# Keeps the list of models each Ollama host serves (from /api/tags) and keeps
+# the models assigned to roles loaded, so the first chat after a deploy or a
+# quiet spell does not wait for the model to load.
+
+
+class ModelCatalog:
+    def __init__(self):
+        self._models = {}  # base_url -> (fetched_at, [model names])
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def models(self, base_urls):
+        names = []
+        for base_url in base_urls:
+            with self._lock:
+                entry = self._models.get(base_url)
+            if entry is None:
+                entry = self.refresh(base_url)
+            elif time.monotonic() - entry[0] > app.config['MODEL_CATALOG_TTL']:
+                # Serve the stale list and refresh behind the request
+                self._refresh_in_background(base_url)
+            names.extend(entry[1] if entry else [])
+        return sorted(set(names))
+
+    def refresh(self, base_url):
+        try:
+            response = get_session().get(f'{base_url}/api/tags', timeout=app.config['OLLAMA_CONNECT_TIMEOUT'])
+            response.raise_for_status()
+            names = [model['name'] for model in response.json().get('models', [])]
+        except (requests.RequestException, ValueError) as e:
+            app.logger.warning("Could not fetch model list from %s: %s", base_url, e)
+            with self._lock:
+                return self._models.get(base_url)
+        entry = (time.monotonic(), names)
+        with self._lock:
+            self._models[base_url] = entry
+        return entry
+
+    def _refresh_in_background(self, base_url):
+        with self._lock:
+            if base_url in self._refreshing:
+                return
+            self._refreshing.add(base_url)
+
+        def run():
+            try:
+                self.refresh(base_url)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(base_url)
+
+        threading.Thread(target=run, name='model-catalog-refresh', daemon=True).start()
+
+
+class WarmupScheduler:
+    # Periodically asks Ollama to load every model assigned to a role and keep
+    # it resident. Models nobody has used within MODEL_ACTIVE_WINDOW are left
+    # to expire, except right after start-up when there is no usage data yet.
+    # Runs in the job worker only (see worker.py), so web workers don't each
+    # repeat the same loads; usage comes from the shared telemetry buckets.
+
+    def __init__(self):
+        self._thread = None
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._started_at = time.time()
+                    self._thread = threading.Thread(target=self._run, name='model-warmup', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    self.warm_up()
+            except Exception:
+                app.logger.exception("Model warm-up pass failed")
+            time.sleep(app.config['MODEL_WARMUP_INTERVAL'])
+
+    def wanted_models(self):
+        models = [model for (model,) in db.session.query(Role.model).filter(Role.model.isnot(None)).distinct()]
+        now = time.time()
+        active_window = app.config['MODEL_ACTIVE_WINDOW']
+        just_started = now - self._started_at < active_window
+        if just_started:
+            return [model for model in models if model]
+        if app.config['TELEMETRY_ENABLED']:
+            since = datetime.utcnow() - timedelta(seconds=active_window)
+            used = {model for (model,) in db.session.query(LlmUsageBucket.model).filter(
+                LlmUsageBucket.bucket_start >= since).distinct()}
+        else:
+            last_used = router.last_used()
+            used = {model for model, used_at in last_used.items() if now - used_at < active_window}
+        return [model for model in models if model and model in used]
+
+    def warm_up(self):
+        urls = [url for (url,) in db.session.query(ProviderSettings.ollama_url).distinct() if url]
+        models = self.wanted_models()
+        # Don't hold a pooled DB connection while waiting on model loads
+        db.session.remove()
+        for url in urls:
+            base_urls = ollama_base_urls(url)
+            available = {model_tag(name) for name in catalog.models(base_urls)}
+            hosts = router.hosts(base_urls)
+            for host in hosts:
+                router.probe(host)
+            # One host per model: one that already has it loaded, otherwise
+            # the healthy host given the fewest models so far, so the models
+            # are spread out instead of evicting each other on the top host
+            assigned = Counter()
+            for model in models:
+                if available and model_tag(model) not in available:
+                    continue
+                healthy = [host for host in hosts if host.healthy] or hosts
+                loaded = [host for host in healthy if model_tag(model) in host.loaded_models]
+                host = loaded[0] if loaded else min(healthy, key=lambda host: assigned[host.url])
+                assigned[host.url] += 1
+                self.preload(host.url, model)
+
+    def preload(self, base_url, model):
+        # A generate call without a prompt loads the model and resets its keep_alive timer
+        try:
+            response = get_session().post(
+                f'{base_url}/api/generate',
+                json={'model': model, 'stream': False, 'keep_alive': app.config['OLLAMA_KEEP_ALIVE']},
+                timeout=(app.config['OLLAMA_CONNECT_TIMEOUT'], app.config['OLLAMA_READ_TIMEOUT']),
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            app.logger.warning("Could not warm up %s on %s: %s", model, base_url, e)
+            return False
+        router.mark_loaded(base_url, model)
+        return True
+
+
+catalog = ModelCatalog()
+warmup_scheduler = WarmupScheduler()
@@ -1,5 +1,7 @@
 from app import db
 from flask_login import UserMixin
+from datetime import datetime
+import json
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'  # Explicitly set the table name
@@ -11,10 +13,19 @@ class User(UserMixin, db.Model):
     provider_settings = db.relationship('ProviderSettings', backref='user', lazy=True)
 
 class Project(db.Model):
+    __table_args__ = (
+        # A user's project list is paged by ascending id
+        db.Index('ix_project_user_id_id', 'user_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Part of the project list ETag, so edits invalidate cached lists
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # History can grow to thousands of rows, so never load it with the project
+    conversations = db.relationship('Conversation', backref='project', lazy='dynamic', passive_deletes=True)
+    messages = db.relationship('Message', lazy='dynamic', passive_deletes=True)
 
     def __repr__(self):
         return f'<Project {self.name}>'
@@ -26,11 +37,53 @@ class Project(db.Model):
             'description': self.description
         }
 
+class Conversation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False, index=True)
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Ollama KV context returned by the last turn, valid while no newer message exists
+    context = db.Column(db.Text, nullable=True)  # Store as JSON string
+    context_model = db.Column(db.String(100), nullable=True)
+    context_message_id = db.Column(db.Integer, nullable=True)
+    # Rolling summary of turns that no longer fit the token budget
+    summary = db.Column(db.Text, nullable=True)
+    summary_message_id = db.Column(db.Integer, nullable=True)
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic', passive_deletes=True)
+
+    def __repr__(self):
+        return f'<Conversation {self.id} project={self.project_id}>'
+
+class Message(db.Model):
+    __table_args__ = (
+        # Keyset pagination walks a project's history by descending id
+        db.Index('ix_message_project_id_id', 'project_id', 'id'),
+        db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', ondelete='CASCADE'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    sender = db.Column(db.String(20), nullable=False)  # 'user', 'ai' or 'system'
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Message {self.id} {self.sender}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'sender': self.sender,
+            'content': self.content,
+            'created_at': self.created_at.isoformat()
+        }
+
 class ProviderSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     provider_name = db.Column(db.String(50), nullable=False)
-    ollama_url = db.Column(db.String(200), nullable=True)
+    ollama_url = db.Column(db.Text, nullable=True)  # One or more comma-separated Ollama hosts
     models = db.Column(db.Text, nullable=True)  # Store as JSON string
 
     def __repr__(self):
@@ -52,6 +105,7 @@ class Role(db.Model):
     system_prompt = db.Column(db.Text, nullable=True)
     web_search = db.Column(db.Boolean, default=False)
     temperature = db.Column(db.Float, default=0.7)
+    cache_responses = db.Column(db.Boolean, default=False)
 
     def __repr__(self):
         return f'<Role {self.name}>'
@@ -64,5 +118,201 @@ class Role(db.Model):
             'model': self.model,
             'system_prompt': self.system_prompt,
             'web_search': self.web_search,
-            'temperature': self.temperature
+            'temperature': self.temperature,
+            'cache_responses': self.cache_responses
+        }
+
+class CacheVersion(db.Model):
+    # One row per cached namespace; bumped in the same transaction as any write
+    # so every worker can tell its in-process copies are stale.
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
+
+class AgentJob(db.Model):
+    __tablename__ = 'agent_job'
+    __table_args__ = (
+        # Workers scan for the oldest runnable job
+        db.Index('ix_agent_job_status_run_after', 'status', 'run_after'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False)
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id', ondelete='SET NULL'), nullable=True)
+    # Set for jobs that run a stage of a workflow (see workflows.py)
+    workflow_stage_id = db.Column(db.Integer, db.ForeignKey('workflow_stage.id', ondelete='CASCADE'), nullable=True)
+    model = db.Column(db.String(100), nullable=False)
+    prompt = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    progress = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AgentJob {self.id} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'role_id': self.role_id,
+            'workflow_stage_id': self.workflow_stage_id,
+            'model': self.model,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
         }
+
+class UserSession(db.Model):
+    __tablename__ = 'user_session'
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<UserSession {self.id[:8]}>'
+
+class LoginFailure(db.Model):
+    # One row per failed login attempt, per username and per client address
+    # (see login_throttle.py)
+    __tablename__ = 'login_failure'
+    __table_args__ = (
+        db.Index('ix_login_failure_key_failed_at', 'key', 'failed_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class LlmTokenBucket(db.Model):
+    # Per-user LLM token budget shared by every process (see admission.py)
+    __tablename__ = 'llm_token_bucket'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+class LlmBackend(db.Model):
+    # One row per Ollama host; updated to serialise lease grants for that host
+    __tablename__ = 'llm_backend'
+    url = db.Column(db.String(255), primary_key=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+
+class LlmLease(db.Model):
+    # A generation slot held on an Ollama host; expires unless renewed, so a
+    # crashed process cannot keep its slots forever
+    __tablename__ = 'llm_lease'
+    __table_args__ = (
+        db.Index('ix_llm_lease_url_expires_at', 'url', 'expires_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    url = db.Column(db.String(255), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    priority = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class WorkflowRun(db.Model):
+    __tablename__ = 'workflow_run'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), nullable=False, index=True)
+    instructions = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, succeeded, failed
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    stages = db.relationship('WorkflowStage', backref='run', order_by='WorkflowStage.id', passive_deletes=True)
+
+    def __repr__(self):
+        return f'<WorkflowRun {self.id} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'instructions': self.instructions,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class WorkflowStage(db.Model):
+    __tablename__ = 'workflow_stage'
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('workflow_run.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id', ondelete='SET NULL'), nullable=True)
+    depends_on = db.Column(db.Text, nullable=False, default='[]')  # JSON list of stage names
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, queued, succeeded, failed, skipped
+    # Output was reused from an earlier run with the same inputs
+    cached = db.Column(db.Boolean, nullable=False, default=False)
+    input_hash = db.Column(db.String(64), nullable=True)
+    job_id = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<WorkflowStage {self.id} {self.name} {self.status}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'role_id': self.role_id,
+            'depends_on': json.loads(self.depends_on),
+            'status': self.status,
+            'cached': self.cached,
+            'input_hash': self.input_hash,
+            'job_id': self.job_id,
+            'error': self.error,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class StageOutput(db.Model):
+    # Workflow stage outputs keyed by a hash of everything that went into them
+    __tablename__ = 'stage_output'
+    input_hash = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    output = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StageOutput {self.input_hash[:12]}>'
+
+class LlmUsageBucket(db.Model):
+    # LLM call statistics rolled up per time bucket, user, role, model and host (see telemetry.py)
+    __tablename__ = 'llm_usage_bucket'
+    __table_args__ = (
+        db.UniqueConstraint('bucket_start', 'user_id', 'role_id', 'model', 'host', name='uq_llm_usage_bucket_key'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_start = db.Column(db.DateTime, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for calls without a user
+    role_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for calls without a role
+    model = db.Column(db.String(100), nullable=False)
+    host = db.Column(db.String(255), nullable=False)
+    calls = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Integer, nullable=False, default=0)
+    queue_wait_seconds = db.Column(db.Float, nullable=False, default=0)
+    ttft_seconds = db.Column(db.Float, nullable=False, default=0)
+    ttft_count = db.Column(db.Integer, nullable=False, default=0)
+    ttft_max_seconds = db.Column(db.Float, nullable=False, default=0)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    prompt_eval_seconds = db.Column(db.Float, nullable=False, default=0)
+    eval_tokens = db.Column(db.Integer, nullable=False, default=0)
+    eval_seconds = db.Column(db.Float, nullable=False, default=0)
+    total_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<LlmUsageBucket {self.bucket_start} {self.model}>'
@@ -0,0 +1,314 @@
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from admission import INTERACTIVE, request_cost, scheduler
+from app import app, db
+from models import ProviderSettings
+from telemetry import recorder as telemetry
+
+# One pooled, keep-alive session per backend process. Requests' Session is safe
+# to share between threads for our usage (no per-request cookies or auth).
+_session = None
+_session_lock = threading.Lock()
+
+
+class OllamaError(Exception):
+    pass
+
+
+class _RetryableError(OllamaError):
+    # The host failed before producing any output, so another host may be tried
+    pass
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=app.config['OLLAMA_POOL_CONNECTIONS'],
+                    pool_maxsize=app.config['OLLAMA_POOL_MAXSIZE'],
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def model_tag(name):
+    # /api/ps reports 'llama3:latest' for a model configured as 'llama3'
+    return name if ':' in name.rsplit('/', 1)[-1] else f'{name}:latest'
+
+
+class OllamaHost:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.in_flight = 0
+        self.loaded_models = set()
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'loaded_models': sorted(self.loaded_models),
+        }
+
+
+class OllamaRouter:
+    # Tracks every Ollama host the app has been configured with. Generations
+    # go to the least-loaded healthy host, preferring hosts that already have
+    # the model in memory; a background thread probes /api/ps to keep health
+    # and loaded-model state fresh, and drops hosts that no user's provider
+    # settings list any more.
+
+    def __init__(self):
+        self._hosts = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def hosts(self, urls):
+        with self._lock:
+            for url in urls:
+                if url not in self._hosts:
+                    self._hosts[url] = OllamaHost(url)
+            hosts = [self._hosts[url] for url in urls]
+        self._ensure_probe_thread()
+        return hosts
+
+    def ranked(self, urls, model):
+        hosts = self.hosts(urls)
+        limit = app.config['OLLAMA_MAX_CONCURRENCY_PER_HOST']
+        with self._lock:
+            return sorted(hosts, key=lambda host: (
+                not host.healthy,
+                host.in_flight >= limit,
+                model_tag(model) not in host.loaded_models,
+                host.in_flight,
+            ))
+
+    def begin(self, host):
+        with self._lock:
+            host.in_flight += 1
+
+    def end(self, host, model=None, failed=False):
+        with self._lock:
+            host.in_flight -= 1
+            if failed:
+                host.healthy = False
+            elif model:
+                host.healthy = True
+                host.loaded_models.add(model_tag(model))
+                self._last_used[model] = time.time()
+
+    def mark_loaded(self, url, model):
+        with self._lock:
+            host = self._hosts.get(url)
+            if host:
+                host.loaded_models.add(model_tag(model))
+
+    def last_used(self):
+        with self._lock:
+            return dict(self._last_used)
+
+    def snapshot(self):
+        with self._lock:
+            return [host.to_dict() for host in self._hosts.values()]
+
+    def _ensure_probe_thread(self):
+        # Started lazily so that each forked worker gets its own thread
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            with self._lock:
+                if self._probe_thread is None or not self._probe_thread.is_alive():
+                    self._probe_thread = threading.Thread(target=self._probe_loop, name='ollama-probe', daemon=True)
+                    self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(app.config['OLLAMA_HEALTH_CHECK_INTERVAL'])
+            try:
+                self._forget_unconfigured()
+            except Exception:
+                app.logger.exception("Could not read the configured Ollama hosts")
+            with self._lock:
+                hosts = list(self._hosts.values())
+            for host in hosts:
+                self.probe(host)
+
+    def _forget_unconfigured(self):
+        with app.app_context():
+            configured = set()
+            for (urls,) in db.session.query(ProviderSettings.ollama_url).distinct():
+                configured.update(ollama_base_urls(urls))
+        with self._lock:
+            for url in [url for url, host in self._hosts.items() if url not in configured and not host.in_flight]:
+                del self._hosts[url]
+
+    def probe(self, host):
+        try:
+            response = get_session().get(f'{host.url}/api/ps', timeout=app.config['OLLAMA_CONNECT_TIMEOUT'])
+            response.raise_for_status()
+            loaded = {model_tag(model['name']) for model in response.json().get('models', [])}
+        except (requests.RequestException, ValueError) as e:
+            if host.healthy:
+                app.logger.warning("Ollama host %s failed health check: %s", host.url, e)
+            with self._lock:
+                host.healthy = False
+            return
+        with self._lock:
+            if not host.healthy:
+                app.logger.info("Ollama host %s is healthy again", host.url)
+            host.healthy = True
+            host.loaded_models = loaded
+
+
+router = OllamaRouter()
+
+
+def ollama_base_url(url):
+    # ProviderSettings.ollama_url has historically held the full generate
+    # endpoint (the browser used to POST to it directly), so accept both forms.
+    if not url:
+        return None
+    url = url.strip().rstrip('/')
+    for suffix in ('/api/generate', '/api/chat', '/api'):
+        if url.endswith(suffix):
+            url = url[:-len(suffix)]
+            break
+    if not urlparse(url).scheme:
+        url = f'http://{url}'
+    return url
+
+
+def ollama_base_urls(urls):
+    # ProviderSettings.ollama_url may list several hosts separated by commas,
+    # whitespace or newlines
+    if not urls:
+        return []
+    return list(dict.fromkeys(ollama_base_url(url) for url in re.split(r'[\s,]+', urls) if url))
+
+
+def stream_generate(base_urls, model, prompt, system=None, temperature=None, context=None, timeout=None,
+                    queue_timeout=None, user_id=None, priority=INTERACTIVE, role_id=None):
+    # Callers charge the user's token budget with scheduler.admit() first;
+    # here the request only waits its fair turn for a host slot
+    if isinstance(base_urls, str):
+        base_urls = [base_urls]
+    payload = {
+        'model': model,
+        'prompt': prompt,
+        'stream': True,
+    }
+    if system:
+        payload['system'] = system
+    if temperature is not None:
+        payload['options'] = {'temperature': temperature}
+    if context:
+        payload['context'] = context
+    if app.config['OLLAMA_KEEP_ALIVE']:
+        payload['keep_alive'] = app.config['OLLAMA_KEEP_ALIVE']
+
+    timeout = timeout or (app.config['OLLAMA_CONNECT_TIMEOUT'], app.config['OLLAMA_READ_TIMEOUT'])
+    if queue_timeout is None:
+        queue_timeout = app.config['OLLAMA_QUEUE_TIMEOUT']
+    cost = request_cost(prompt, system, context=context)
+
+    # First look for a host with a free slot, then wait on each in turn with
+    # an equal share of the time left, so busy hosts don't add up to N
+    # queue timeouts
+    deadline = time.monotonic() + queue_timeout
+    hosts = router.ranked(base_urls, model)
+    failed_urls = set()
+    last_error = None
+    for waiting in (False, True):
+        for index, host in enumerate(hosts):
+            if host.url in failed_urls:
+                continue
+            wait = max(deadline - time.monotonic(), 0) / (len(hosts) - index) if waiting else 0
+            try:
+                served = yield from _generate_on(host, payload, timeout, model, cost, wait, user_id, priority,
+                                                 role_id)
+            except _RetryableError as e:
+                app.logger.warning("Ollama host %s failed, trying next host: %s", host.url, e)
+                failed_urls.add(host.url)
+                last_error = e
+                continue
+            if served:
+                return
+            last_error = OllamaError(f'Timed out waiting for a free slot on {host.url}')
+    raise last_error or OllamaError('No Ollama hosts configured')
+
+
+def _generate_on(host, payload, timeout, model, cost, queue_timeout, user_id, priority, role_id):
+    # Streams the generation from one host once it has a slot there; returns
+    # False if no slot came free within queue_timeout
+    queued = time.perf_counter()
+    lease = scheduler.acquire(host.url, user_id, priority, cost, timeout=queue_timeout)
+    if lease is None:
+        return False
+    router.begin(host)
+    succeeded = failed = False
+    call = telemetry.call(user_id, role_id, model, host.url, time.perf_counter() - queued)
+    try:
+        for chunk in _stream_generate(host.url, payload, timeout):
+            call.observe(chunk)
+            yield chunk
+        succeeded = True
+        return True
+    except _RetryableError:
+        call.failed = failed = True
+        raise
+    except OllamaError:
+        call.failed = True
+        raise
+    finally:
+        lease.release()
+        call.finish()
+        router.end(host, model=model if succeeded else None, failed=failed)
+
+
+def _stream_generate(base_url, payload, timeout):
+    try:
+        response = get_session().post(f'{base_url}/api/generate', json=payload, stream=True, timeout=timeout)
+    except requests.RequestException as e:
+        raise _RetryableError(f'Could not reach Ollama at {base_url}: {e}') from e
+
+    with response:
+        if response.status_code >= 500:
+            raise _RetryableError(f'Ollama returned {response.status_code}: {response.text[:200]}')
+        if response.status_code != 200:
+            raise OllamaError(f'Ollama returned {response.status_code}: {response.text[:200]}')
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError as e:
+                    raise OllamaError(f'Bad response from Ollama at {base_url}: {e}') from e
+                if not isinstance(chunk, dict):
+                    raise OllamaError(f'Bad response from Ollama at {base_url}: {line[:200]!r}')
+                if chunk.get('error'):
+                    raise OllamaError(chunk['error'])
+                yield chunk
+                if chunk.get('done'):
+                    break
+        except requests.RequestException as e:
+            raise OllamaError(f'Connection to Ollama at {base_url} was interrupted: {e}') from e
+
+
+def sse_event(data, event=None):
+    message = f'data: {json.dumps(data)}\n\n'
+    if event:
+        message = f'event: {event}\n{message}'
+    return message
@@ -0,0 +1,69 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app
+from ollama_client import OllamaError, stream_generate
+from web_search import with_web_results
+
+# Fans one prompt out to several roles at once. Each role streams on a pool
+# thread and pushes its tokens onto a shared queue, so the caller sees the
+# replies interleaved as they arrive. The admission scheduler makes any excess
+# roles wait their turn for a host slot rather than overloading Ollama.
+
+_executor = ThreadPoolExecutor(max_workers=app.config['PANEL_MAX_WORKERS'], thread_name_prefix='panel')
+
+
+def run_panel(base_urls, prompt, roles, timeout, user_id=None, web_results=()):
+    # Yields (kind, role_id, payload) tuples where kind is 'token', 'done' or
+    # 'error'. Every role ends with exactly one 'done' or 'error'. Roles with
+    # web search enabled get web_results ahead of the prompt.
+    events = queue.Queue()
+    cancelled = threading.Event()
+    deadline = time.monotonic() + timeout
+
+    def worker(role):
+        error = None
+        try:
+            remaining = max(deadline - time.monotonic(), 0)
+            role_prompt = with_web_results(prompt, web_results) if role.web_search else prompt
+            chunks = stream_generate(
+                base_urls, role.model, role_prompt, system=role.system_prompt, temperature=role.temperature,
+                timeout=(app.config['OLLAMA_CONNECT_TIMEOUT'], min(app.config['OLLAMA_READ_TIMEOUT'], timeout)),
+                queue_timeout=remaining, user_id=user_id, role_id=role.id,
+            )
+            for chunk in chunks:
+                if cancelled.is_set():
+                    break
+                if time.monotonic() > deadline:
+                    raise OllamaError(f'Timed out after {timeout:.0f}s')
+                if chunk.get('response'):
+                    events.put(('token', role.id, chunk['response']))
+        except OllamaError as e:
+            error = str(e)
+        except Exception:
+            app.logger.exception("Panel worker for role %s failed", role.id)
+            error = 'Unexpected error'
+        finally:
+            events.put(('error', role.id, error) if error else ('done', role.id, None))
+
+    pending = {role.id for role in roles}
+    for role in roles:
+        _executor.submit(worker, role)
+
+    try:
+        while pending:
+            try:
+                kind, role_id, payload = events.get(timeout=max(deadline - time.monotonic(), 0) + 1)
+            except queue.Empty:
+                cancelled.set()
+                for role_id in pending:
+                    yield 'error', role_id, f'Timed out after {timeout:.0f}s'
+                return
+            if kind != 'token':
+                pending.discard(role_id)
+            yield kind, role_id, payload
+    finally:
+        # Client went away or we timed out: let the workers free their slots
+        cancelled.set()
@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import app
+
+# Password hashing and verification in a bounded process pool, so a burst of
+# logins uses every core without starving the request threads of the GIL.
+# Calls beyond the pool plus PASSWORD_HASH_QUEUE_SIZE waiting calls are turned
+# away with PasswordHashBusy rather than queued without limit.
+# PASSWORD_HASH_ITERATIONS is the pbkdf2 work factor; hashes stored with any
+# other method are rehashed the next time their owner logs in.
+
+
+class PasswordHashBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    @property
+    def method(self):
+        return f"pbkdf2:sha256:{app.config['PASSWORD_HASH_ITERATIONS']}"
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    def _run(self, func, *args):
+        if app.config['PASSWORD_HASH_WORKERS'] <= 0:
+            return func(*args)
+        pool, slots = self._ensure_pool()
+        if not slots.acquire(blocking=False):
+            raise PasswordHashBusy()
+        try:
+            return pool.submit(func, *args).result()
+        finally:
+            slots.release()
+
+    def _ensure_pool(self):
+        # Pools do not survive fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    workers = app.config['PASSWORD_HASH_WORKERS']
+                    # forkserver children start clean instead of copying a threaded worker
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+                    self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE_SIZE'])
+                    self._pid = os.getpid()
+        return self._pool, self._slots
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,278 @@
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+import requests
+
+import lookup_cache
+from admission import BACKGROUND, INTERACTIVE, scheduler
+from app import app, db
+from models import Message, Project
+from ollama_client import OllamaError, get_session, ollama_base_urls, router
+from prompt_builder import estimate_tokens
+from vector_index import VectorStore
+
+# Semantic memory for each project: the project description and every chat
+# message are split into chunks, embedded and kept in a per-project vector
+# index on disk (see vector_index.py). Chat turns retrieve the chunks closest
+# to the new prompt and hand them to the prompt builder.
+#
+# Indexing never runs on the request thread. Writes only mark a project as
+# dirty; a background thread in each process picks dirty projects up after a
+# short delay, so bursts of messages are embedded together in batches. A file
+# lock per project keeps processes sharing the index directory from indexing
+# the same project at once.
+
+SPEAKERS = {'user': 'User', 'ai': 'Assistant', 'system': 'System'}
+MESSAGE_PAGE_SIZE = 200
+
+
+def chunk_text(text, size, overlap):
+    # Overlapping windows that break on whitespace where possible
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            space = text.rfind(' ', start + size // 2, end)
+            if space != -1:
+                end = space
+        chunks.append(text[start:end].strip())
+        if end == len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+
+class OllamaEmbedder:
+    def __init__(self, base_urls, model, user_id=None):
+        self.base_urls = base_urls
+        self.model = model
+        self.user_id = user_id
+
+    def embed(self, texts, timeout=None, priority=BACKGROUND):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        host = router.ranked(self.base_urls, self.model)[0]
+        cost = sum(estimate_tokens(text) for text in texts)
+        lease = scheduler.acquire(host.url, self.user_id, priority, cost, timeout=timeout)
+        if lease is None:
+            raise OllamaError(f'Timed out waiting for a free slot on {host.url}')
+        # Embedding calls stay out of the router's health and loaded-model
+        # state: a slow query embed or a missing embedding model says nothing
+        # about the host's ability to serve chats
+        try:
+            response = get_session().post(
+                f'{host.url}/api/embed',
+                json={'model': self.model, 'input': texts, 'keep_alive': app.config['OLLAMA_KEEP_ALIVE']},
+                timeout=timeout or (app.config['OLLAMA_CONNECT_TIMEOUT'], app.config['OLLAMA_READ_TIMEOUT']),
+            )
+            response.raise_for_status()
+            embeddings = response.json().get('embeddings') or []
+        except (requests.RequestException, ValueError) as e:
+            raise OllamaError(f'Embedding request to {host.url} failed: {e}') from e
+        finally:
+            lease.release()
+        if len(embeddings) != len(texts):
+            raise OllamaError(f'Expected {len(texts)} embeddings from {host.url}, got {len(embeddings)}')
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class StubEmbedder:
+    # Hashed bag of words, for tests and running without an embedding model
+    model = 'stub'
+    dim = 256
+
+    def embed(self, texts, timeout=None, priority=BACKGROUND):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                bucket = int.from_bytes(hashlib.md5(word.encode('utf-8')).digest()[:4], 'little')
+                vectors[row, bucket % self.dim] += 1
+        return vectors
+
+
+def get_embedder(user_id):
+    if app.config['EMBEDDING_BACKEND'] == 'stub':
+        return StubEmbedder()
+    settings = lookup_cache.get_provider_settings(user_id)
+    base_urls = ollama_base_urls(settings.ollama_url) if settings else []
+    if not base_urls:
+        return None
+    return OllamaEmbedder(base_urls, app.config['EMBEDDING_MODEL'], user_id)
+
+
+class ProjectIndex:
+    def __init__(self, project_id):
+        self.path = os.path.join(app.config['EMBEDDING_INDEX_DIR'], f'project_{project_id}')
+        self.description = VectorStore(os.path.join(self.path, 'description'))
+        self.messages = VectorStore(os.path.join(self.path, 'messages'))
+
+    def exists(self):
+        return os.path.exists(self.messages.state_path)
+
+    def lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        return _FileLock(os.path.join(self.path, '.lock'))
+
+    def search(self, query_vector, k, min_score):
+        hits = []
+        for store in (self.description, self.messages):
+            # Over-fetch so that hits dropped by the caller's filters can be replaced
+            hits.extend(store.search(query_vector, k * 3, min_score)[0])
+        return sorted(hits, key=lambda hit: hit[0], reverse=True)
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+class ProjectIndexer:
+    def __init__(self):
+        self._dirty = set()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def mark_dirty(self, project_id):
+        if not app.config['EMBEDDING_ENABLED']:
+            return
+        with self._lock:
+            self._dirty.add(project_id)
+        self._ensure_started()
+        self._wakeup.set()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run, name='project-indexer', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Let a burst of writes pile up so it is embedded in one go
+            time.sleep(app.config['EMBEDDING_BATCH_DELAY'])
+            self._wakeup.clear()
+            with self._lock:
+                project_ids, self._dirty = self._dirty, set()
+            for project_id in sorted(project_ids):
+                try:
+                    with app.app_context():
+                        self.index_project(project_id)
+                except Exception:
+                    app.logger.exception("Indexing project %s failed", project_id)
+
+    def index_project(self, project_id):
+        index = ProjectIndex(project_id)
+        project = db.session.get(Project, project_id)
+        if project is None:
+            shutil.rmtree(index.path, ignore_errors=True)
+            return
+        user_id = project.user_id
+        project_text = f'{project.name}\n\n{project.description or ""}'
+        db.session.remove()
+
+        embedder = get_embedder(user_id)
+        if embedder is None:
+            return
+        chunk_size = app.config['EMBEDDING_CHUNK_CHARS']
+        overlap = app.config['EMBEDDING_CHUNK_OVERLAP']
+        with index.lock():
+            state = index.messages.state()
+            if state.get('model') != embedder.model:
+                # Vectors from different models can't be compared; start over
+                index.description.clear(model=embedder.model)
+                state = index.messages.clear(model=embedder.model, last_message_id=0)
+
+            text_hash = hashlib.sha256(project_text.encode('utf-8')).hexdigest()
+            if index.description.state().get('text_hash') != text_hash:
+                chunks = chunk_text(project_text, chunk_size, overlap)
+                index.description.clear(model=embedder.model)
+                index.description.append(self._embed(embedder, chunks), [{'source': 'project', 'text': chunk} for chunk in chunks],
+                                         text_hash=text_hash)
+
+            last_message_id = state.get('last_message_id', 0)
+            while True:
+                page = db.session.query(Message.id, Message.conversation_id, Message.sender, Message.content).filter(
+                    Message.project_id == project_id, Message.id > last_message_id
+                ).order_by(Message.id).limit(MESSAGE_PAGE_SIZE).all()
+                db.session.remove()
+                if not page:
+                    break
+                chunks, metadata = [], []
+                for message in page:
+                    speaker = SPEAKERS.get(message.sender, 'User')
+                    for chunk in chunk_text(message.content, chunk_size, overlap):
+                        chunks.append(f'{speaker}: {chunk}')
+                        metadata.append({'source': 'message', 'message_id': message.id,
+                                         'conversation_id': message.conversation_id, 'text': f'{speaker}: {chunk}'})
+                last_message_id = page[-1].id
+                index.messages.append(self._embed(embedder, chunks), metadata, last_message_id=last_message_id)
+                if len(page) < MESSAGE_PAGE_SIZE:
+                    break
+
+    def _embed(self, embedder, chunks):
+        batch_size = app.config['EMBEDDING_BATCH_SIZE']
+        batches = [embedder.embed(chunks[start:start + batch_size]) for start in range(0, len(chunks), batch_size)]
+        return np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+
+def retrieve(project_id, user_id, query, exclude_conversation_id=None, exclude_after_id=None):
+    # Chunks of project memory most similar to query, best first. Messages of
+    # the current conversation newer than exclude_after_id are skipped because
+    # they are already part of the prompt history.
+    if not app.config['EMBEDDING_ENABLED']:
+        return []
+    index = ProjectIndex(project_id)
+    if not index.exists():
+        indexer.mark_dirty(project_id)
+        return []
+    embedder = get_embedder(user_id)
+    if embedder is None:
+        return []
+    try:
+        query_vector = embedder.embed([query], timeout=app.config['EMBEDDING_QUERY_TIMEOUT'], priority=INTERACTIVE)
+    except OllamaError as e:
+        app.logger.warning("Skipping project memory for project %s: %s", project_id, e)
+        return []
+
+    try:
+        hits = index.search(query_vector, app.config['RAG_TOP_K'], app.config['RAG_MIN_SCORE'])
+    except (OSError, ValueError) as e:
+        # The index was being rebuilt under this search
+        app.logger.warning("Skipping project memory for project %s: %s", project_id, e)
+        return []
+    texts = []
+    for score, record in hits:
+        if (record['source'] == 'message' and record['conversation_id'] == exclude_conversation_id
+                and record['message_id'] > (exclude_after_id or 0)):
+            continue
+        if record['text'] not in texts:
+            texts.append(record['text'])
+        if len(texts) == app.config['RAG_TOP_K']:
+            break
+    return texts
+
+
+indexer = ProjectIndexer()
@@ -0,0 +1,135 @@
+import json
+import re
+
+from app import app, db
+from models import Message
+
+# Builds what is sent to Ollama for a chat turn. When the conversation's last
+# turn left an Ollama KV context behind, only the new prompt is sent with that
+# context so Ollama skips re-prefilling the history. Otherwise the role's
+# system prompt goes first as a stable prefix, followed by a rolling summary of
+# old turns, notes retrieved from the project's memory and as many recent
+# turns as fit the model's token budget.
+
+HISTORY_PAGE_SIZE = 50
+SUMMARY_SNIPPET_CHARS = 200
+SPEAKERS = {'user': 'User', 'ai': 'Assistant', 'system': 'System'}
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text with Llama-style tokenizers
+    return len(text) // 4 + 1 if text else 0
+
+
+def token_budget(model):
+    for item in app.config['MODEL_TOKEN_BUDGETS'].split(','):
+        if ':' in item:
+            name, budget = item.rsplit(':', 1)
+            if name.strip() == model:
+                return int(budget)
+    return app.config['PROMPT_TOKEN_BUDGET']
+
+
+def build_prompt(conversation, model, system_prompt, prompt, notes=(), web_results=()):
+    # Returns (prompt, system, context) for stream_generate. notes are chunks
+    # retrieved from the project's memory and web_results excerpts from a web
+    # search, each best first.
+    budget = token_budget(model) - app.config['PROMPT_RESPONSE_RESERVE']
+    notes = '\n\n'.join(filter(None, [
+        _fit_notes(web_results, budget // 8, 'Web search results:'),
+        _fit_notes(notes, budget // 8),
+    ]))
+    last_id = db.session.query(db.func.max(Message.id)).filter(Message.conversation_id == conversation.id).scalar()
+
+    if (conversation.context and conversation.context_model == model
+            and conversation.context_message_id == last_id):
+        context = json.loads(conversation.context)
+        user_turn = '\n\n'.join(filter(None, [notes, prompt]))
+        if len(context) + estimate_tokens(user_turn) <= budget:
+            # The context already holds the system prompt and every earlier turn
+            return user_turn, None, context
+
+    if last_id is None:
+        return '\n\n'.join(filter(None, [notes, prompt])), system_prompt, None
+
+    summary_budget = budget // 4
+    available = (budget - estimate_tokens(system_prompt) - estimate_tokens(prompt) - estimate_tokens(notes)
+                 - summary_budget)
+    turns, oldest_kept_id, trimmed = _recent_turns(conversation, available)
+    if trimmed:
+        _extend_summary(conversation, oldest_kept_id or last_id + 1, summary_budget)
+
+    parts = []
+    if conversation.summary:
+        parts.append(f'Summary of the earlier conversation:\n{conversation.summary}')
+    if notes:
+        parts.append(notes)
+    parts.extend(reversed(turns))
+    parts.append(f'User: {prompt}')
+    return '\n\n'.join(parts), system_prompt, None
+
+
+def _fit_notes(notes, notes_budget, heading='Relevant notes from this project:'):
+    lines = []
+    for note in notes:
+        if estimate_tokens('\n'.join(lines + [f'- {note}'])) > notes_budget:
+            break
+        lines.append(f'- {note}')
+    if not lines:
+        return ''
+    return f'{heading}\n' + '\n'.join(lines)
+
+
+def _recent_turns(conversation, available):
+    # Newest-first walk over the conversation, one index page at a time
+    turns = []
+    oldest_kept_id = None
+    before_id = None
+    while True:
+        query = Message.query.filter(Message.conversation_id == conversation.id)
+        if conversation.summary_message_id:
+            query = query.filter(Message.id > conversation.summary_message_id)
+        if before_id:
+            query = query.filter(Message.id < before_id)
+        page = query.order_by(Message.id.desc()).limit(HISTORY_PAGE_SIZE).all()
+        for message in page:
+            line = f"{SPEAKERS.get(message.sender, 'User')}: {message.content}"
+            cost = estimate_tokens(line)
+            if cost > available:
+                return turns, oldest_kept_id, True
+            available -= cost
+            turns.append(line)
+            oldest_kept_id = message.id
+        if len(page) < HISTORY_PAGE_SIZE:
+            return turns, oldest_kept_id, False
+        before_id = page[-1].id
+
+
+def _extend_summary(conversation, before_id, summary_budget):
+    # Folds messages that fell out of the window into the summary. Only
+    # messages newer than the previous fold are read, so each turn does a
+    # bounded amount of work.
+    query = Message.query.filter(Message.conversation_id == conversation.id, Message.id < before_id)
+    if conversation.summary_message_id:
+        query = query.filter(Message.id > conversation.summary_message_id)
+    lines = conversation.summary.split('\n') if conversation.summary else []
+    last_folded_id = None
+    for message in query.order_by(Message.id).yield_per(HISTORY_PAGE_SIZE):
+        snippet = re.split(r'(?<=[.!?])\s', message.content.strip(), maxsplit=1)[0][:SUMMARY_SNIPPET_CHARS]
+        lines.append(f"- {SPEAKERS.get(message.sender, 'User')}: {snippet}")
+        last_folded_id = message.id
+    if last_folded_id is None:
+        return
+
+    # Keep the newest lines that fit
+    while lines and estimate_tokens('\n'.join(lines)) > summary_budget:
+        lines.pop(0)
+    conversation.summary = '\n'.join(lines)
+    conversation.summary_message_id = last_folded_id
+    db.session.commit()
+
+
+def remember_context(conversation, model, context, message_id):
+    conversation.context = json.dumps(context) if context else None
+    conversation.context_model = model if context else None
+    conversation.context_message_id = message_id if context else None
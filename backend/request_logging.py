@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, session
+
+# Application logging without I/O on the request thread. Records go onto a
+# bounded in-memory queue and a listener thread formats them as JSON lines and
+# writes them out. Access logs are sampled (errors and slow requests are always
+# kept), and LOG_ROUTE_LEVELS can raise or lower the level for single routes.
+
+ACCESS_LOGGER = 'idea_incubator.access'
+
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RouteLevelFilter(logging.Filter):
+    def __init__(self, default_level, route_levels):
+        super().__init__()
+        self.default_level = default_level
+        self.route_levels = route_levels
+
+    def filter(self, record):
+        level = self.default_level
+        if self.route_levels and has_request_context():
+            level = self.route_levels.get(request.endpoint, level)
+        return record.levelno >= level
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # Hands records to the listener as they are. The stock prepare() formats
+    # the message on the calling thread, which is what we want to avoid.
+
+    def __init__(self, log_queue, handlers):
+        super().__init__(log_queue)
+        self.handlers = handlers
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on logging; count what we lose instead
+            self.dropped += 1
+
+    def _ensure_listener(self):
+        # Listener threads do not survive fork, so each worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = os.getpid()
+
+    def stop(self):
+        if self._listener and self._pid == os.getpid():
+            self._listener.stop()
+
+
+def _parse_level(name, setting, problems):
+    # Unknown names make getLevelName return a string; fall back to INFO
+    level = logging.getLevelName(name.strip().upper())
+    if not isinstance(level, int):
+        problems.append((name, setting))
+        return logging.INFO
+    return level
+
+
+def _parse_route_levels(value, problems):
+    levels = {}
+    for item in value.split(','):
+        if ':' in item:
+            route, level = item.split(':', 1)
+            levels[route.strip()] = _parse_level(level, 'LOG_ROUTE_LEVELS', problems)
+    return levels
+
+
+def configure_logging(app):
+    problems = []
+    level = _parse_level(app.config['LOG_LEVEL'], 'LOG_LEVEL', problems)
+    stream_handler = logging.StreamHandler()
+    if app.config['LOG_FORMAT'] == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE']), [stream_handler])
+    route_levels = _parse_route_levels(app.config['LOG_ROUTE_LEVELS'], problems)
+    handler.addFilter(RouteLevelFilter(level, route_levels))
+
+    for logger in (app.logger, logging.getLogger(ACCESS_LOGGER)):
+        logger.handlers[:] = [handler]
+        # Cheap level check first; the route filter makes the final call
+        logger.setLevel(min([level, *route_levels.values()]))
+        logger.propagate = False
+    for name, setting in problems:
+        app.logger.warning("Unknown log level %r in %s, using INFO", name, setting)
+
+    access_logger = logging.getLogger(ACCESS_LOGGER)
+    sample_rate = app.config['LOG_SAMPLE_RATE']
+    slow_request = app.config['LOG_SLOW_REQUEST_SECONDS']
+
+    @app.before_request
+    def _start_access_timer():
+        g.access_log_started = time.perf_counter()
+
+    @app.after_request
+    def _log_access(response):
+        started = g.get('access_log_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        notable = response.status_code >= 500 or duration >= slow_request
+        if notable or random.random() < sample_rate:
+            access_logger.log(
+                logging.WARNING if notable else logging.INFO,
+                '%s %s %s %.1fms', request.method, request.path, response.status_code, duration * 1000,
+                extra={
+                    'endpoint': request.endpoint,
+                    'status': response.status_code,
+                    'duration_ms': round(duration * 1000, 1),
+                    'user_id': session.get('user_id'),
+                    'sampled': sample_rate,
+                },
+            )
+        return response
+
+    return handler
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from app import app
+
+# Cache of complete LLM replies for roles that opt in with Role.cache_responses.
+# Entries live in an LRU memory tier and, when RESPONSE_CACHE_DIR is set, in an
+# on-disk tier shared by every worker on the host. Both tiers are bounded by
+# size. Identical requests that arrive while a reply is being generated wait
+# for that generation instead of starting their own.
+
+
+def make_key(model, system_prompt, temperature, prompt, history=()):
+    history_hash = hashlib.sha256(json.dumps(list(history)).encode('utf-8')).hexdigest()
+    material = json.dumps([model, system_prompt or '', temperature, prompt, history_hash])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class ResponseCache:
+    def __init__(self, max_memory_bytes, disk_dir=None, max_disk_bytes=0):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(disk_dir) if entry.is_file())
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                return value
+        value = self._disk_get(key)
+        if value is not None:
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value):
+        self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def claim(self, key):
+        # Returns (flight, is_leader). The leader must call finish() exactly once.
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight:
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            return flight, True
+
+    def finish(self, key, value):
+        if value:
+            self.put(key, value)
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight:
+            flight.value = value
+            flight.done.set()
+
+    def _memory_put(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous.encode('utf-8'))
+            self._memory[key] = value
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted.encode('utf-8'))
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}.txt')
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                value = f.read()
+            os.utime(path)  # mtime doubles as the LRU clock for eviction
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        data = value.encode('utf-8')
+        if len(data) > self.max_disk_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            app.logger.warning("Could not write response cache entry %s: %s", key, e)
+            return
+        with self._lock:
+            self._disk_bytes += len(data)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Other workers write to the same directory, so recount from disk
+        entries = sorted(
+            (entry for entry in os.scandir(self.disk_dir) if entry.is_file() and entry.name.endswith('.txt')),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        target = self.max_disk_bytes * 0.9
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+
+response_cache = ResponseCache(
+    max_memory_bytes=app.config['RESPONSE_CACHE_MEMORY_BYTES'],
+    disk_dir=app.config['RESPONSE_CACHE_DIR'],
+    max_disk_bytes=app.config['RESPONSE_CACHE_DISK_BYTES'],
+)
@@ -1,11 +1,32 @@
-from flask import jsonify, session, render_template, url_for, request, redirect, make_response
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import jsonify, session, render_template, url_for, request, redirect, make_response, Response, stream_with_context
 from urllib.parse import urlparse
-from models import User, Project, ProviderSettings, Role
+from models import User, Project, ProviderSettings, Role, Conversation, Message, AgentJob, WorkflowRun
 from app import app, db
 from flask_login import login_user, login_required, logout_user, current_user
 from functools import wraps
+from ollama_client import OllamaError, ollama_base_urls, router as ollama_router, sse_event, stream_generate
+import lookup_cache
+from response_cache import make_key as make_cache_key, response_cache
+from panel import run_panel
+from jobs import TERMINAL_STATUSES, submit_job
+from prompt_builder import build_prompt, remember_context
+from model_catalog import catalog
+from metrics import registry as metrics_registry
+from passwords import PasswordHashBusy, hasher
+from admission import AdmissionRejected, request_cost, scheduler as llm_scheduler
+from login_throttle import throttle as login_throttle
+from search import search as full_text_search
+import project_memory
+import workflows
+import telemetry
+from assets import send_asset
+from transfer import export_user, import_user, upsert_roles
+from web_search import format_results as format_web_results, web_search
+from sqlalchemy.exc import OperationalError, ProgrammingError
+import hashlib
 import json
+import time
+from datetime import datetime, timedelta
 
 # Move the login_required decorator definition here
 def login_required(f):
@@ -23,7 +44,7 @@ def login_required(f):
 @login_required
 def project_interaction(project_id):
     project = Project.query.get_or_404(project_id)
-    return render_template('project_interaction.html', project=project)
+    return render_template('project_interaction.html', project=project, panel_roles=lookup_cache.get_all_roles())
 
 def login_required(f):
     @wraps(f)
@@ -48,7 +69,7 @@ def register():
     
     username = data['username']
     email = data['email']
-    password = generate_password_hash(data['password'], method='pbkdf2:sha256')
+    password = hasher.hash(data['password'])
     
     new_user = User(username=username, email=email, password=password)
     db.session.add(new_user)
@@ -70,27 +91,66 @@ def index():
         if not data or 'username' not in data or 'password' not in data:
             return jsonify({'message': 'Missing username or password'}), 400
         
+        retry_after = login_throttle.retry_after(data['username'], request.remote_addr)
+        if retry_after:
+            app.logger.warning("Throttled login attempt for username: %s", data['username'])
+            response = jsonify({'message': 'Too many failed login attempts, try again later'})
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response, 429
+
         user = User.query.filter_by(username=data['username']).first()
+        # Release the pooled connection while the password is checked; the
+        # detached user keeps its loaded attributes
+        db.session.close()
         
-        if user and check_password_hash(user.password, data['password']):
+        if user and hasher.verify(user.password, data['password']):
+            login_throttle.record_success(data['username'])
+            if hasher.needs_rehash(user.password):
+                User.query.filter_by(id=user.id).update({'password': hasher.hash(data['password'])})
+                db.session.commit()
+            regenerate_session()
             login_user(user)
+            session.permanent = True
             session['user_id'] = user.id  # Explicitly set user_id in session
-            app.logger.info(f"User {user.id} logged in successfully")
-            app.logger.info(f"Session after login: {session}")
+            app.logger.info("User %s logged in successfully", user.id)
             next_page = request.args.get('next')
             if not next_page or urlparse(next_page).netloc != '':
                 next_page = url_for('dashboard')
             return jsonify({'message': 'Login successful!', 'redirect': next_page})
         
-        app.logger.warning(f"Failed login attempt for username: {data['username']}")
+        login_throttle.record_failure(data['username'], request.remote_addr)
+        app.logger.warning("Failed login attempt for username: %s", data['username'])
         return jsonify({'message': 'Invalid credentials!'}), 401
     
     return render_template('index.html')
 
+@app.errorhandler(PasswordHashBusy)
+def password_hash_busy(e):
+    app.logger.warning("Password hashing pool is full, rejecting request")
+    response = jsonify({'message': 'Server busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(AdmissionRejected)
+def llm_admission_rejected(e):
+    response = jsonify({'message': 'You are sending requests too quickly, please wait a moment'})
+    response.headers['Retry-After'] = str(max(int(e.retry_after + 0.999), 1))
+    return response, 429
+
+def regenerate_session():
+    # New session id on login and logout against session fixation. The
+    # database and filesystem stores key sessions by id; cookie sessions
+    # carry their data in the cookie and get a new value anyway.
+    regenerate = getattr(app.session_interface, 'regenerate', None)
+    if regenerate:
+        regenerate(session)
+
 @app.route('/logout', methods=['POST'])
 @login_required
 def logout():
     logout_user()
+    session.pop('user_id', None)
+    regenerate_session()
     return jsonify({'message': 'Logged out successfully!'})
 
 @app.route('/login')
@@ -104,8 +164,6 @@ def register_page():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    app.logger.info(f"Accessing dashboard. User ID in session: {session.get('user_id')}")
-    app.logger.info(f"Current user: {current_user}")
     return render_template('dashboard.html', username=current_user.username)
 
 @app.route('/user_settings', methods=['GET', 'POST'])
@@ -118,12 +176,19 @@ def user_settings():
     if request.method == 'POST':
         data = request.form
         if 'username' in data and 'email' in data and 'currentPassword' in data:
-            if check_password_hash(user.password, data['currentPassword']):
+            retry_after = login_throttle.retry_after(user.username, request.remote_addr)
+            if retry_after:
+                app.logger.warning("Throttled password check for user %s", user.id)
+                response = jsonify({'message': 'Too many failed password attempts, try again later'})
+                response.headers['Retry-After'] = str(int(retry_after) + 1)
+                return response, 429
+            if hasher.verify(user.password, data['currentPassword']):
                 user.username = data['username']
                 user.email = data['email']
                 db.session.commit()
                 return jsonify({'message': 'Profile updated successfully!'})
             else:
+                login_throttle.record_failure(user.username, request.remote_addr)
                 return jsonify({'message': 'Current password is incorrect'}), 400
         else:
             return jsonify({'message': 'Missing required fields'}), 400
@@ -162,6 +227,7 @@ def provider_settings():
             new_settings = ProviderSettings(user_id=user_id, provider_name=provider_name, ollama_url=ollama_url, models=models)
             db.session.add(new_settings)
 
+        lookup_cache.bump(lookup_cache.PROVIDER_SETTINGS)
         db.session.commit()
         return jsonify({'message': 'Provider settings updated successfully!'})
 
@@ -180,7 +246,7 @@ def agents_settings():
 @login_required
 def roles_settings():
     user_id = session['user_id']
-    provider_settings = ProviderSettings.query.filter_by(user_id=user_id).first()
+    provider_settings = lookup_cache.get_provider_settings(user_id)
     
     if request.method == 'POST':
         role_id = request.form.get('role_id')
@@ -190,67 +256,103 @@ def roles_settings():
             role.model = request.form.get('model')
             role.system_prompt = request.form.get('system_prompt')
             role.web_search = 'web_search' in request.form
+            role.cache_responses = 'cache_responses' in request.form
             role.temperature = float(request.form.get('temperature', 0.7))
+            lookup_cache.bump(lookup_cache.ROLE)
             db.session.commit()
             return jsonify({'message': 'Role updated successfully!'})
         return jsonify({'message': 'Role not found'}), 404
 
-    roles = Role.query.all()
+    roles = lookup_cache.get_all_roles()
     providers = [provider_settings.provider_name] if provider_settings else []
-    models = provider_settings.models.split(',') if provider_settings and provider_settings.models else []
+    models = catalog.models(ollama_base_urls(provider_settings.ollama_url)) if provider_settings else []
+    if not models and provider_settings and provider_settings.models:
+        # Fall back to the hand-maintained list when no host answers
+        models = [model.strip() for model in provider_settings.models.split(',')]
     
     return render_template('roles_settings.html', roles=roles, providers=providers, models=models)
 
 from role_prompts import ROLE_PROMPTS
 
+PLANNER_ROLE_NAME = 'AI Agent - Project Planner'
+
 @app.route('/initialize_roles', methods=['POST'])
 @login_required
 def initialize_roles():
-    for role_name, role_data in ROLE_PROMPTS.items():
-        existing_role = Role.query.filter_by(name=role_name).first()
-        if existing_role:
-            existing_role.system_prompt = role_data['prompt']
-            existing_role.temperature = role_data['temperature']
-        else:
-            new_role = Role(name=role_name, system_prompt=role_data['prompt'], temperature=role_data['temperature'])
-            db.session.add(new_role)
-    
+    rows = [{'name': role_name, 'system_prompt': role_data['prompt'], 'temperature': role_data['temperature']}
+            for role_name, role_data in ROLE_PROMPTS.items()]
+    upsert_roles(db.session.connection(), rows, update=('system_prompt', 'temperature'))
+    lookup_cache.bump(lookup_cache.ROLE)
     db.session.commit()
     return jsonify({'message': 'Roles initialized successfully!'})
 
+PROJECT_PAGE_SIZE = 50
+
+def get_project_page(user_id, after_id=None, limit=PROJECT_PAGE_SIZE, details=False):
+    # Keyset pagination over the (user_id, id) index, loading only the listed columns
+    columns = [Project.id, Project.name]
+    if details:
+        columns.append(Project.description)
+    query = db.session.query(*columns).filter(Project.user_id == user_id)
+    if after_id:
+        query = query.filter(Project.id > after_id)
+    rows = query.order_by(Project.id).limit(limit).all()
+    projects = [row._asdict() for row in rows]
+    return projects, projects[-1]['id'] if len(projects) == limit else None
+
+def project_list_etag(user_id, *params):
+    # Adding, editing or deleting a project changes the count or the latest updated_at
+    count, last_updated = db.session.query(
+        db.func.count(Project.id), db.func.max(Project.updated_at)
+    ).filter(Project.user_id == user_id).one()
+    material = json.dumps([user_id, count, str(last_updated), *params])
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
 @app.route('/projects')
 @login_required
 def projects_page():
-    app.logger.info(f"Session: {session}")
-    app.logger.info(f"Request headers: {request.headers}")
-    app.logger.info(f"Request cookies: {request.cookies}")
-    
-    app.logger.info(f"User {session['user_id']} accessing projects page")
-    
-    user = User.query.get(session['user_id'])
-    projects = Project.query.filter_by(user_id=session['user_id']).all()
-    
     if request.headers.get('Accept') == 'application/json':
-        return jsonify({'projects': [project.to_dict() for project in projects]})
-    else:
-        return render_template('projects.html', username=user.username, projects=projects)
+        return list_projects()
+    projects, next_after_id = get_project_page(session['user_id'], details=True)
+    return render_template('projects.html', username=current_user.username, projects=projects,
+                           next_after_id=next_after_id)
 
-@app.after_request
-def after_request(response):
-    app.logger.info(f"After request - Session: {session}")
-    app.logger.info(f"After request - Response headers: {response.headers}")
-    return response
-
-@app.route('/projects', methods=['GET'])
-def get_projects():
+@app.route('/api/projects', methods=['GET'])
+def list_projects():
     if 'user_id' not in session:
         return jsonify({'message': 'Unauthorized'}), 401
     user_id = session['user_id']
-    projects = Project.query.filter_by(user_id=user_id).all()
-    app.logger.info(f"User ID: {user_id}, Number of projects: {len(projects)}")
-    for project in projects:
-        app.logger.info(f"Project ID: {project.id}, Name: {project.name}")
-    return jsonify({'projects': [project.to_dict() for project in projects]})
+    after_id = request.args.get('after_id', type=int)
+    limit = max(min(request.args.get('limit', PROJECT_PAGE_SIZE, type=int), 200), 1)
+    details = request.args.get('details', 'false').lower() == 'true'
+
+    etag = project_list_etag(user_id, after_id, limit, details)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        projects, next_after_id = get_project_page(user_id, after_id, limit, details)
+        app.logger.debug("Returning %d projects for user %s", len(projects), user_id)
+        response = jsonify({'projects': projects, 'next_after_id': next_after_id})
+    response.set_etag(etag)
+    # Let browsers keep the list but revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/search', methods=['GET'])
+@login_required
+def search_projects():
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'message': 'Missing search query'}), 400
+    limit = max(min(request.args.get('limit', 20, type=int), 100), 1)
+    include_messages = request.args.get('messages', 'true').lower() == 'true'
+    try:
+        results = full_text_search(current_user.id, q, limit, include_messages)
+    except (OperationalError, ProgrammingError):
+        db.session.rollback()
+        app.logger.exception("Full-text search failed; has the add_search_index migration run?")
+        return jsonify({'message': 'Search is not available'}), 503
+    return jsonify(results)
 
 @app.route('/project', methods=['POST'])
 def create_project():
@@ -260,6 +362,7 @@ def create_project():
     new_project = Project(name=data['name'], description=data['description'], user_id=session['user_id'])
     db.session.add(new_project)
     db.session.commit()
+    project_memory.indexer.mark_dirty(new_project.id)
     return jsonify({'success': True, 'message': 'Project created successfully'})
 
 @app.route('/project/<int:project_id>', methods=['GET', 'PUT', 'DELETE'])
@@ -271,20 +374,23 @@ def manage_project(project_id):
 
     if request.method == 'GET':
         # Fetch the AI Agent Project Planner role
-        planner_role = Role.query.filter_by(name='AI Agent Project Planner').first()
+        planner_role = lookup_cache.get_role_by_name(PLANNER_ROLE_NAME)
         
-        return render_template('project_interaction.html', project=project, planner_role=planner_role)
+        return render_template('project_interaction.html', project=project, planner_role=planner_role,
+                               panel_roles=lookup_cache.get_all_roles())
     
     elif request.method == 'PUT':
         data = request.json
         project.name = data['name']
         project.description = data['description']
         db.session.commit()
+        project_memory.indexer.mark_dirty(project_id)
         return jsonify({'success': True, 'message': 'Project updated successfully'})
     
     elif request.method == 'DELETE':
         db.session.delete(project)
         db.session.commit()
+        project_memory.indexer.mark_dirty(project_id)
         return jsonify({'success': True, 'message': 'Project deleted successfully'})
     
 @app.route('/api/project/<int:project_id>/details', methods=['GET'])
@@ -293,13 +399,13 @@ def get_project_details(project_id):
     project = Project.query.get_or_404(project_id)
     
     # Fetch the "AI Agent - Project Planner" role
-    planner_role = Role.query.filter_by(name="AI Agent - Project Planner").first()
+    planner_role = lookup_cache.get_role_by_name(PLANNER_ROLE_NAME)
     
     if not planner_role:
         return jsonify({"error": "AI Agent - Project Planner role not found"}), 404
     
     # Fetch the ProviderSettings for the current user
-    provider_settings = ProviderSettings.query.filter_by(user_id=current_user.id).first()
+    provider_settings = lookup_cache.get_provider_settings(current_user.id)
     
     if not provider_settings:
         return jsonify({"error": "Provider settings not found"}), 404
@@ -314,3 +420,381 @@ def get_project_details(project_id):
         "role_web_search": "Enabled" if planner_role.web_search else "Disabled",
         "role_temperature": planner_role.temperature or "Not set"
     })
+
+def get_or_create_conversation(project_id, role_id):
+    conversation = Conversation.query.filter_by(project_id=project_id, role_id=role_id).first()
+    if not conversation:
+        conversation = Conversation(project_id=project_id, role_id=role_id)
+        db.session.add(conversation)
+        db.session.commit()
+    return conversation
+
+def save_chat_turns(project_id, prompt, replies, contexts=None):
+    # replies is a list of (conversation_id, reply) and contexts maps
+    # conversation_id to (model, Ollama context); everything goes in one commit
+    messages = []
+    replies_by_conversation = {}
+    for conversation_id, reply in replies:
+        messages.append(Message(conversation_id=conversation_id, project_id=project_id, sender='user', content=prompt))
+        if reply:
+            replies_by_conversation[conversation_id] = Message(conversation_id=conversation_id, project_id=project_id,
+                                                               sender='ai', content=reply)
+            messages.append(replies_by_conversation[conversation_id])
+    db.session.add_all(messages)
+    if contexts:
+        db.session.flush()
+        for conversation_id, (model, context) in contexts.items():
+            reply_message = replies_by_conversation.get(conversation_id)
+            remember_context(db.session.get(Conversation, conversation_id), model,
+                             context if reply_message else None, reply_message.id if reply_message else None)
+    db.session.commit()
+    project_memory.indexer.mark_dirty(project_id)
+
+@app.route('/api/project/<int:project_id>/chat', methods=['POST'])
+@login_required
+def project_chat(project_id):
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+    if not project:
+        return jsonify({'message': 'Project not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    prompt = (data.get('message') or '').strip()
+    if not prompt:
+        return jsonify({'message': 'Missing message'}), 400
+
+    if data.get('role_id'):
+        role = lookup_cache.get_role(data['role_id'])
+    else:
+        role = lookup_cache.get_role_by_name(PLANNER_ROLE_NAME)
+    if not role:
+        return jsonify({'message': 'Role not found'}), 404
+    if not role.model:
+        return jsonify({'message': f'No model assigned to role {role.name}'}), 400
+
+    provider_settings = lookup_cache.get_provider_settings(current_user.id)
+    base_urls = ollama_base_urls(provider_settings.ollama_url) if provider_settings else []
+    if not base_urls:
+        return jsonify({'message': 'Provider settings not found'}), 404
+
+    conversation = get_or_create_conversation(project.id, role.id)
+    conversation_id = conversation.id
+    model = role.model
+    temperature = role.temperature
+    user_id = current_user.id
+    # Charged before the memory and web lookups so the 429 comes before the
+    # stream starts; those lookups run after the start event, off the
+    # time to first token
+    llm_scheduler.admit(user_id, request_cost(prompt, role.system_prompt,
+                                              context=json.loads(conversation.context or '[]')))
+
+    def generate():
+        tokens = []
+        completed = False
+        new_context = None
+        cached, is_leader = None, False
+        yield sse_event({'role': role.name, 'model': model, 'conversation_id': conversation_id}, event='start')
+        notes = project_memory.retrieve(project_id, user_id, prompt, exclude_conversation_id=conversation_id,
+                                        exclude_after_id=conversation.summary_message_id)
+        web_results = format_web_results(web_search.search(prompt)) if role.web_search else []
+        full_prompt, system_prompt, context = build_prompt(conversation, model, role.system_prompt, prompt, notes,
+                                                           web_results)
+        cache_key = None
+        if role.cache_responses:
+            cache_key = make_cache_key(model, role.system_prompt, temperature, prompt, history=[full_prompt, context])
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is None:
+                # Identical concurrent requests wait for a single upstream generation
+                flight, is_leader = response_cache.claim(cache_key)
+                if not is_leader and flight.done.wait(app.config['OLLAMA_READ_TIMEOUT']):
+                    cached = flight.value
+        try:
+            if cached:
+                tokens.append(cached)
+                completed = True
+                yield sse_event({'token': cached, 'cached': True})
+                yield sse_event({'done_reason': 'cached'}, event='done')
+            else:
+                chunks = stream_generate(base_urls, model, full_prompt, system=system_prompt,
+                                         temperature=temperature, context=context, user_id=user_id,
+                                         role_id=role.id)
+                for chunk in chunks:
+                    if chunk.get('response'):
+                        tokens.append(chunk['response'])
+                        yield sse_event({'token': chunk['response']})
+                    if chunk.get('done'):
+                        completed = True
+                        new_context = chunk.get('context')
+                        yield sse_event({'done_reason': chunk.get('done_reason')}, event='done')
+        except OllamaError as e:
+            app.logger.error("Chat stream for project %s failed: %s", project_id, e)
+            yield sse_event({'message': 'Failed to get response from AI. Please try again.'}, event='error')
+        finally:
+            reply = ''.join(tokens)
+            if is_leader:
+                response_cache.finish(cache_key, reply if completed else None)
+            # Persist the whole turn in one round trip once the reply has finished
+            save_chat_turns(project_id, prompt, [(conversation_id, reply)],
+                            contexts={conversation_id: (model, new_context)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/project/<int:project_id>/messages', methods=['GET'])
+@login_required
+def get_project_messages(project_id):
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+    if not project:
+        return jsonify({'message': 'Project not found'}), 404
+
+    limit = max(min(request.args.get('limit', 50, type=int), 200), 1)
+    before_id = request.args.get('before_id', type=int)
+
+    # Keyset pagination over the (project_id, id) index: each page is a short
+    # index range scan no matter how deep into the history the client is.
+    query = Message.query.filter(Message.project_id == project.id)
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    page = query.order_by(Message.id.desc()).limit(limit).all()
+    page.reverse()
+
+    return jsonify({
+        'messages': [message.to_dict() for message in page],
+        'next_before_id': page[0].id if len(page) == limit else None
+    })
+
+@app.route('/api/project/<int:project_id>/panel', methods=['POST'])
+@login_required
+def project_panel(project_id):
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+    if not project:
+        return jsonify({'message': 'Project not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    prompt = (data.get('message') or '').strip()
+    role_ids = data.get('role_ids') or []
+    if not prompt or not role_ids:
+        return jsonify({'message': 'Missing message or role_ids'}), 400
+    if not isinstance(role_ids, list) or not all(
+            isinstance(role_id, int) and not isinstance(role_id, bool) for role_id in role_ids):
+        return jsonify({'message': 'role_ids must be a list of role ids'}), 400
+    try:
+        timeout = float(data.get('timeout') or app.config['PANEL_ROLE_TIMEOUT'])
+    except (TypeError, ValueError):
+        timeout = None
+    if timeout is None or not timeout > 0:
+        return jsonify({'message': 'timeout must be a positive number of seconds'}), 400
+    timeout = min(timeout, app.config['PANEL_ROLE_TIMEOUT'])
+
+    roles = []
+    for role_id in dict.fromkeys(role_ids):
+        role = lookup_cache.get_role(role_id)
+        if not role:
+            return jsonify({'message': f'Role {role_id} not found'}), 404
+        if not role.model:
+            return jsonify({'message': f'No model assigned to role {role.name}'}), 400
+        roles.append(role)
+
+    provider_settings = lookup_cache.get_provider_settings(current_user.id)
+    base_urls = ollama_base_urls(provider_settings.ollama_url) if provider_settings else []
+    if not base_urls:
+        return jsonify({'message': 'Provider settings not found'}), 404
+
+    conversation_ids = {role.id: get_or_create_conversation(project.id, role.id).id for role in roles}
+    web_results = format_web_results(web_search.search(prompt)) if any(role.web_search for role in roles) else []
+    user_id = current_user.id
+    llm_scheduler.admit(user_id, sum(request_cost(prompt, role.system_prompt) for role in roles))
+
+    def generate():
+        replies = {role.id: [] for role in roles}
+        yield sse_event({'roles': [{'id': role.id, 'name': role.name, 'model': role.model} for role in roles]},
+                        event='start')
+        try:
+            for kind, role_id, payload in run_panel(base_urls, prompt, roles, timeout, user_id, web_results):
+                if kind == 'token':
+                    replies[role_id].append(payload)
+                    yield sse_event({'role_id': role_id, 'token': payload})
+                elif kind == 'done':
+                    yield sse_event({'role_id': role_id}, event='done')
+                else:
+                    app.logger.error("Panel role %s for project %s failed: %s", role_id, project_id, payload)
+                    yield sse_event({'role_id': role_id, 'message': payload}, event='error')
+            yield sse_event({}, event='complete')
+        finally:
+            save_chat_turns(project_id, prompt,
+                            [(conversation_ids[role_id], ''.join(tokens)) for role_id, tokens in replies.items()])
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/provider/hosts', methods=['GET'])
+@login_required
+def provider_hosts():
+    provider_settings = lookup_cache.get_provider_settings(current_user.id)
+    base_urls = ollama_base_urls(provider_settings.ollama_url) if provider_settings else []
+    hosts = ollama_router.hosts(base_urls)
+    if request.args.get('refresh'):
+        for host in hosts:
+            ollama_router.probe(host)
+    return jsonify({'hosts': [host.to_dict() for host in hosts]})
+
+@app.route('/api/project/<int:project_id>/jobs', methods=['POST'])
+@login_required
+def create_agent_job(project_id):
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+    if not project:
+        return jsonify({'message': 'Project not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    prompt = (data.get('message') or '').strip()
+    if not prompt or not data.get('role_id'):
+        return jsonify({'message': 'Missing message or role_id'}), 400
+
+    role = lookup_cache.get_role(data['role_id'])
+    if not role:
+        return jsonify({'message': 'Role not found'}), 404
+    if not role.model:
+        return jsonify({'message': f'No model assigned to role {role.name}'}), 400
+
+    job = submit_job(current_user.id, project.id, role, prompt)
+    return jsonify({'job': job.to_dict()}), 202
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_agent_job(job_id):
+    job = AgentJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify({'job': job.to_dict()})
+
+@app.route('/api/jobs/<int:job_id>/events', methods=['GET'])
+@login_required
+def agent_job_events(job_id):
+    job = AgentJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+
+    def generate():
+        sent = 0
+        status = None
+        while True:
+            current = db.session.get(AgentJob, job_id)
+            events = []
+            if current is None:
+                # Deleted along with its project
+                events.append(sse_event({'message': 'Job not found'}, event='error'))
+            else:
+                if current.status != status:
+                    status = current.status
+                    events.append(sse_event({'status': status, 'attempts': current.attempts}, event='status'))
+                progress = current.progress or ''
+                if len(progress) > sent:
+                    events.append(sse_event({'token': progress[sent:]}))
+                    sent = len(progress)
+                elif len(progress) < sent:
+                    # A retry started over
+                    events.append(sse_event({'progress': progress}, event='reset'))
+                    sent = len(progress)
+                if status in TERMINAL_STATUSES:
+                    events.append(sse_event(current.to_dict(), event='done'))
+            # Hand the connection back to the pool before writing to the
+            # client or sleeping; the next poll starts a new transaction and
+            # sees the worker's latest commit
+            db.session.remove()
+            yield from events
+            if current is None or status in TERMINAL_STATUSES:
+                return
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/api/project/<int:project_id>/workflows', methods=['GET', 'POST'])
+@login_required
+def project_workflows(project_id):
+    project = Project.query.filter_by(id=project_id, user_id=current_user.id).first()
+    if not project:
+        return jsonify({'message': 'Project not found'}), 404
+
+    if request.method == 'GET':
+        runs = WorkflowRun.query.filter_by(project_id=project.id).order_by(WorkflowRun.id.desc()).limit(20).all()
+        return jsonify({'workflows': [run.to_dict() for run in runs]})
+
+    data = request.get_json(silent=True) or {}
+    try:
+        stages = workflows.resolve_stages(data.get('stages') or workflows.DEFAULT_STAGES)
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    instructions = data.get('instructions') or ''
+    if not isinstance(instructions, str):
+        return jsonify({'message': 'instructions must be a string'}), 400
+    run = workflows.start_workflow(current_user.id, project, stages, instructions.strip() or None)
+    return jsonify({'workflow': workflows.workflow_details(db.session.get(WorkflowRun, run.id))}), 202
+
+@app.route('/api/workflows/<int:run_id>', methods=['GET'])
+@login_required
+def get_workflow(run_id):
+    run = WorkflowRun.query.filter_by(id=run_id, user_id=current_user.id).first()
+    if not run:
+        return jsonify({'message': 'Workflow not found'}), 404
+    return jsonify({'workflow': workflows.workflow_details(run)})
+
+@app.route('/api/telemetry/models', methods=['GET'])
+@login_required
+def compare_models():
+    hours = min(max(request.args.get('hours', 24, type=float), 0), 24 * app.config['TELEMETRY_RETENTION_DAYS'])
+    group_by = [name for name in (request.args.get('by') or 'model').split(',') if name]
+    if not group_by or any(name not in telemetry.GROUPS for name in group_by):
+        return jsonify({'message': f"by must be a comma-separated list of {', '.join(telemetry.GROUPS)}"}), 400
+    since = datetime.utcnow() - timedelta(hours=hours)
+    rows = telemetry.compare(current_user.id, since, group_by, role_id=request.args.get('role_id', type=int),
+                             model=request.args.get('model'))
+    if 'role_id' in group_by:
+        roles = {role.id: role.name for role in lookup_cache.get_all_roles()}
+        for row in rows:
+            row['role'] = roles.get(row['role_id'])
+    return jsonify({'since': since.isoformat(), 'bucket_seconds': app.config['TELEMETRY_BUCKET_SECONDS'],
+                    'models': rows})
+
+@app.route('/api/export', methods=['GET'])
+@login_required
+def export_data():
+    filename = f"idea-incubator-{current_user.username}-{datetime.utcnow():%Y%m%d}.ndjson"
+    return Response(stream_with_context(export_user(current_user.id)), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+    })
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def import_data():
+    try:
+        counts = import_user(current_user.id, request.stream)
+    except ValueError as e:
+        return jsonify({'message': f'Import failed: {e}'}), 400
+    return jsonify({'message': 'Import complete', 'imported': counts})
+
+@app.route('/api/models', methods=['GET'])
+@login_required
+def list_models():
+    provider_settings = lookup_cache.get_provider_settings(current_user.id)
+    base_urls = ollama_base_urls(provider_settings.ollama_url) if provider_settings else []
+    if request.args.get('refresh'):
+        for base_url in base_urls:
+            catalog.refresh(base_url)
+    return jsonify({'models': catalog.models(base_urls)})
+
+@app.route('/assets/<path:filename>', methods=['GET'])
+def asset(filename):
+    return send_asset(filename)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'message': 'Not found'}), 404
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,50 @@
+import os
+import time
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import app, db
+
+# Schema state checks for app start-up. Migrations are applied by migrate.py
+# (a separate step in deploys); the web process only compares the database's
+# Alembic revision with the head of migrations/versions, which takes a single
+# query.
+
+MIGRATIONS_DIR = os.path.join(app.root_path, 'migrations')
+
+
+def wait_for_database(retries=5, delay=5):
+    for attempt in range(retries):
+        try:
+            with app.app_context(), db.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            return
+        except OperationalError as e:
+            if attempt < retries - 1:
+                print(f"Database connection attempt {attempt + 1} failed: {e}. Retrying in {delay} seconds...")
+                time.sleep(delay)
+            else:
+                print("Failed to connect to the database after multiple attempts.")
+                raise e
+
+
+def expected_heads():
+    config = Config()
+    config.set_main_option('script_location', MIGRATIONS_DIR)
+    return set(ScriptDirectory.from_config(config).get_heads())
+
+
+def current_heads():
+    with app.app_context(), db.engine.connect() as conn:
+        return set(MigrationContext.configure(conn).get_current_heads())
+
+
+def check_schema():
+    # Returns (ok, current, expected)
+    current = current_heads()
+    expected = expected_heads()
+    return current == expected, current, expected
@@ -0,0 +1,119 @@
+import re
+
+from markupsafe import escape
+from sqlalchemy import DateTime, text
+
+from app import db
+
+# Ranked full-text search over a user's projects and chat messages. Postgres
+# uses the GIN-indexed search_vector columns, SQLite the FTS5 tables; both
+# are created by the add_search_index migration. Highlights come back as HTML
+# with the matched terms wrapped in <mark> and everything else escaped.
+
+# Control characters the highlighter wraps matches in; they cannot occur in
+# the escaped text, so they are safe to swap for <mark> tags afterwards
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+POSTGRES_PROJECTS = text("""
+    SELECT p.id, p.name, rank,
+           ts_headline('english', coalesce(p.name, '') || ' ' || coalesce(p.description, ''), query,
+                       'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=30, MinWords=10, MaxFragments=2') AS headline
+    FROM (
+        SELECT project.id, ts_rank(project.search_vector, query) AS rank, query
+        FROM project, websearch_to_tsquery('english', :q) AS query
+        WHERE project.user_id = :user_id AND project.search_vector @@ query
+        ORDER BY rank DESC, project.id
+        LIMIT :limit
+    ) AS hits
+    JOIN project p ON p.id = hits.id
+    ORDER BY rank DESC, p.id
+""")
+
+POSTGRES_MESSAGES = text("""
+    SELECT m.id, m.project_id, project.name AS project_name, m.sender, m.created_at, rank,
+           ts_headline('english', m.content, query,
+                       'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=30, MinWords=10, MaxFragments=2') AS headline
+    FROM (
+        SELECT message.id, ts_rank(message.search_vector, query) AS rank, query
+        FROM message
+        JOIN project ON project.id = message.project_id,
+             websearch_to_tsquery('english', :q) AS query
+        WHERE project.user_id = :user_id AND message.search_vector @@ query
+        ORDER BY rank DESC, message.id DESC
+        LIMIT :limit
+    ) AS hits
+    JOIN message m ON m.id = hits.id
+    JOIN project ON project.id = m.project_id
+    ORDER BY rank DESC, m.id DESC
+""").columns(created_at=DateTime)
+
+# bm25() is lower for better matches; its column weights favour names
+SQLITE_PROJECTS = text("""
+    SELECT project.id, project.name, -bm25(project_fts, 10.0, 1.0) AS rank,
+           snippet(project_fts, -1, char(2), char(3), '...', 24) AS headline
+    FROM project_fts
+    JOIN project ON project.id = project_fts.rowid
+    WHERE project_fts MATCH :q AND project.user_id = :user_id
+    ORDER BY bm25(project_fts, 10.0, 1.0), project.id
+    LIMIT :limit
+""")
+
+SQLITE_MESSAGES = text("""
+    SELECT message.id, message.project_id, project.name AS project_name, message.sender, message.created_at,
+           -bm25(message_fts) AS rank,
+           snippet(message_fts, 0, char(2), char(3), '...', 24) AS headline
+    FROM message_fts
+    JOIN message ON message.id = message_fts.rowid
+    JOIN project ON project.id = message.project_id
+    WHERE message_fts MATCH :q AND project.user_id = :user_id
+    ORDER BY bm25(message_fts), message.id DESC
+    LIMIT :limit
+""").columns(created_at=DateTime)
+
+
+def _fts5_query(q):
+    # Quote every word so user input can't be read as FTS5 query syntax; the
+    # last word also matches as a prefix, for search-as-you-type
+    words = re.findall(r'\w+', q)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _highlight(headline):
+    return str(escape(headline or '')).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search(user_id, q, limit=20, include_messages=True):
+    if db.engine.dialect.name == 'postgresql':
+        params = {'q': q, 'user_id': user_id, 'limit': limit}
+        projects_sql, messages_sql = POSTGRES_PROJECTS, POSTGRES_MESSAGES
+    else:
+        match = _fts5_query(q)
+        if match is None:
+            return {'projects': [], 'messages': []}
+        params = {'q': match, 'user_id': user_id, 'limit': limit}
+        projects_sql, messages_sql = SQLITE_PROJECTS, SQLITE_MESSAGES
+
+    projects = [
+        {'id': row.id, 'name': row.name, 'rank': float(row.rank), 'headline': _highlight(row.headline)}
+        for row in db.session.execute(projects_sql, params)
+    ]
+    messages = []
+    if include_messages:
+        messages = [
+            {
+                'id': row.id,
+                'project_id': row.project_id,
+                'project_name': row.project_name,
+                'sender': row.sender,
+                'created_at': row.created_at.isoformat(),
+                'rank': float(row.rank),
+                'headline': _highlight(row.headline),
+            }
+            for row in db.session.execute(messages_sql, params)
+        ]
+    return {'projects': projects, 'messages': messages}
@@ -0,0 +1,133 @@
+import secrets
+import threading
+import time
+from datetime import datetime
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+
+from app import app, db
+from models import UserSession
+
+# Server-side sessions stored in the user_session table, shared by every
+# backend container. A row is written only when the session changed or when
+# less than half of its lifetime is left, and expired rows are deleted in
+# small batches in the background. The id is replaced on login and logout
+# (regenerate()) so a session id planted before login is worthless after it.
+
+
+class DatabaseSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+
+
+class DatabaseSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self._last_cleanup = time.monotonic()
+        self._cleanup_lock = threading.Lock()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='database-session')
+
+    def open_session(self, app, request):
+        if request.endpoint in ('static', 'asset'):
+            # Assets never touch the session; skip the lookup
+            return DatabaseSession()
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                with db.engine.connect() as conn:
+                    row = conn.execute(
+                        db.select(UserSession.data, UserSession.expires_at)
+                        .where(UserSession.id == sid, UserSession.expires_at > datetime.utcnow())
+                    ).first()
+                if row:
+                    return DatabaseSession(self.serializer.loads(row.data), sid=sid, expires_at=row.expires_at)
+        return DatabaseSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        # Same data under a new id; the old row is deleted right away
+        if not session.new:
+            with db.engine.begin() as conn:
+                conn.execute(db.delete(UserSession).where(UserSession.id == session.sid))
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.expires_at = None
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                if not session.new:
+                    with db.engine.begin() as conn:
+                        conn.execute(db.delete(UserSession).where(UserSession.id == session.sid))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.utcnow()
+        refresh_due = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if session.modified or refresh_due:
+            expires_at = now + lifetime
+            with db.engine.begin() as conn:
+                if session.modified:
+                    values = {'data': self.serializer.dumps(dict(session)), 'expires_at': expires_at}
+                else:
+                    values = {'expires_at': expires_at}
+                updated = conn.execute(
+                    db.update(UserSession).where(UserSession.id == session.sid).values(**values)
+                ).rowcount
+                if not updated:
+                    conn.execute(db.insert(UserSession).values(
+                        id=session.sid, data=self.serializer.dumps(dict(session)), expires_at=expires_at))
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid.encode('utf-8')).decode('utf-8'),
+                expires=expires_at,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+        self._maybe_cleanup()
+
+    def _maybe_cleanup(self):
+        if time.monotonic() - self._last_cleanup < app.config['SESSION_CLEANUP_INTERVAL']:
+            return
+        with self._cleanup_lock:
+            if time.monotonic() - self._last_cleanup < app.config['SESSION_CLEANUP_INTERVAL']:
+                return
+            self._last_cleanup = time.monotonic()
+        threading.Thread(target=delete_expired_sessions, name='session-cleanup', daemon=True).start()
+
+
+def delete_expired_sessions(batch_size=500):
+    # Short batches over the expires_at index so cleanup never holds long locks
+    deleted = 0
+    with app.app_context():
+        while True:
+            with db.engine.begin() as conn:
+                expired = db.select(UserSession.id).where(UserSession.expires_at < datetime.utcnow()).limit(batch_size)
+                count = conn.execute(db.delete(UserSession).where(UserSession.id.in_(expired))).rowcount
+            deleted += count
+            if count < batch_size:
+                break
+    if deleted:
+        app.logger.info("Deleted %d expired sessions", deleted)
+    return deleted
@@ -0,0 +1,191 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import LlmUsageBucket
+
+# Per-call LLM statistics: queue wait, time to first token, and prompt-eval
+# and eval token counts and durations as reported in Ollama's final stream
+# chunk. Calls are summed in memory per (time bucket, user, role, model,
+# host) and a background thread in each process adds the sums onto
+# llm_usage_bucket rows, so the table grows by one row per key per bucket
+# rather than per call.
+
+SUM_FIELDS = ('calls', 'errors', 'queue_wait_seconds', 'ttft_seconds', 'ttft_count', 'prompt_tokens',
+              'prompt_eval_seconds', 'eval_tokens', 'eval_seconds', 'total_seconds')
+GROUPS = ('model', 'role_id', 'host')
+EPOCH = datetime(1970, 1, 1)
+
+
+def bucket_start(moment):
+    # Start of the bucket holding a naive UTC datetime
+    size = app.config['TELEMETRY_BUCKET_SECONDS']
+    return EPOCH + timedelta(seconds=(moment - EPOCH).total_seconds() // size * size)
+
+
+class LlmCall:
+    def __init__(self, recorder, user_id, role_id, model, host, queue_wait):
+        self.recorder = recorder
+        self.key = (user_id or 0, role_id or 0, model, host)
+        self.queue_wait = queue_wait
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.stats = {}
+        self.failed = False
+
+    def observe(self, chunk):
+        if self.first_token is None and (chunk.get('response') or chunk.get('done')):
+            self.first_token = time.perf_counter() - self.started
+        if chunk.get('done'):
+            self.stats = chunk
+
+    def finish(self):
+        self.recorder.add(self)
+
+
+class TelemetryRecorder:
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_prune = 0
+
+    def call(self, user_id, role_id, model, host, queue_wait):
+        return LlmCall(self, user_id, role_id, model, host, queue_wait)
+
+    def add(self, call):
+        if not app.config['TELEMETRY_ENABLED']:
+            return
+        stats = call.stats
+        values = {
+            'calls': 1,
+            'errors': int(call.failed),
+            'queue_wait_seconds': call.queue_wait,
+            'ttft_seconds': call.first_token or 0,
+            'ttft_count': int(call.first_token is not None),
+            'prompt_tokens': stats.get('prompt_eval_count', 0),
+            'prompt_eval_seconds': stats.get('prompt_eval_duration', 0) / 1e9,
+            'eval_tokens': stats.get('eval_count', 0),
+            'eval_seconds': stats.get('eval_duration', 0) / 1e9,
+            'total_seconds': stats.get('total_duration', 0) / 1e9,
+        }
+        key = (bucket_start(datetime.utcnow()),) + call.key
+        with self._lock:
+            totals = self._pending.setdefault(key, dict.fromkeys(SUM_FIELDS, 0) | {'ttft_max_seconds': 0})
+            for field in SUM_FIELDS:
+                totals[field] += values[field]
+            totals['ttft_max_seconds'] = max(totals['ttft_max_seconds'], call.first_token or 0)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run, name='telemetry-flush', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config['TELEMETRY_FLUSH_INTERVAL'])
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("Flushing LLM telemetry failed")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with app.app_context():
+            for key, totals in pending.items():
+                self._write(key, totals)
+            if time.monotonic() - self._last_prune > 3600:
+                self._prune()
+                self._last_prune = time.monotonic()
+
+    def _write(self, key, totals, retry=True):
+        table = LlmUsageBucket.__table__
+        start, user_id, role_id, model, host = key
+        where = (table.c.bucket_start == start, table.c.user_id == user_id, table.c.role_id == role_id,
+                 table.c.model == model, table.c.host == host)
+        values = {field: table.c[field] + totals[field] for field in SUM_FIELDS}
+        values['ttft_max_seconds'] = db.case(
+            (table.c.ttft_max_seconds < totals['ttft_max_seconds'], totals['ttft_max_seconds']),
+            else_=table.c.ttft_max_seconds,
+        )
+        try:
+            with db.engine.begin() as conn:
+                if conn.execute(db.update(table).where(*where).values(values)).rowcount == 0:
+                    conn.execute(db.insert(table).values(bucket_start=start, user_id=user_id, role_id=role_id,
+                                                         model=model, host=host, **totals))
+        except IntegrityError:
+            # Another process inserted the bucket first; add onto its row
+            if not retry:
+                raise
+            self._write(key, totals, retry=False)
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(days=app.config['TELEMETRY_RETENTION_DAYS'])
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(LlmUsageBucket.__table__).where(LlmUsageBucket.bucket_start < cutoff))
+
+
+def compare(user_id, since, group_by=('model',), role_id=None, model=None):
+    # Totals per group of one user's calls since a naive UTC datetime, with
+    # averages and rates derived from the sums. Groups are any of model,
+    # role_id and host.
+    columns = [getattr(LlmUsageBucket, name) for name in group_by]
+    sums = [db.func.sum(getattr(LlmUsageBucket, field)).label(field) for field in SUM_FIELDS]
+    query = db.session.query(*columns, *sums, db.func.max(LlmUsageBucket.ttft_max_seconds).label('ttft_max_seconds'))
+    query = query.filter(LlmUsageBucket.user_id == user_id, LlmUsageBucket.bucket_start >= bucket_start(since))
+    if role_id is not None:
+        query = query.filter(LlmUsageBucket.role_id == role_id)
+    if model:
+        query = query.filter(LlmUsageBucket.model == model)
+    rows = []
+    for row in query.group_by(*columns).all():
+        data = row._asdict()
+        calls = data['calls'] or 0
+        rows.append({
+            **{name: data[name] for name in group_by},
+            'calls': calls,
+            'errors': data['errors'] or 0,
+            'error_rate': _ratio(data['errors'], calls),
+            'avg_queue_wait_seconds': _ratio(data['queue_wait_seconds'], calls),
+            'avg_ttft_seconds': _ratio(data['ttft_seconds'], data['ttft_count']),
+            'max_ttft_seconds': _round(data['ttft_max_seconds']),
+            'prompt_tokens': data['prompt_tokens'] or 0,
+            'eval_tokens': data['eval_tokens'] or 0,
+            'prompt_tokens_per_second': _ratio(data['prompt_tokens'], data['prompt_eval_seconds']),
+            'tokens_per_second': _ratio(data['eval_tokens'], data['eval_seconds']),
+            'avg_total_seconds': _ratio(data['total_seconds'], calls),
+        })
+    return sorted(rows, key=lambda item: item['tokens_per_second'] or 0, reverse=True)
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if numerator is not None and denominator else None
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+recorder = TelemetryRecorder()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        recorder.flush()
+    except Exception:
+        pass
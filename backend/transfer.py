@@ -0,0 +1,295 @@
+import argparse
+import io
+import json
+import sys
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+
+import lookup_cache
+from app import app, db
+from models import Conversation, Message, Project, ProviderSettings, Role, User
+
+# Backup and migration of one user's data as NDJSON: one {"type", "data"}
+# object per line, parents before children, so both directions stream in
+# constant memory.
+#
+#     python transfer.py export --username alice -o alice.ndjson
+#     python transfer.py import --username bob alice.ndjson
+#     python transfer.py import --username bob --update-roles alice.ndjson
+#
+# Export reads with server-side cursors. Import writes in batches inside one
+# transaction: projects, conversations and messages get fresh ids (taken from
+# the sequence up front, then loaded with COPY on PostgreSQL or executemany on
+# SQLite), and roles are matched by name with INSERT ... ON CONFLICT. Roles are
+# shared by all users, so an import only adds missing ones unless
+# --update-roles asks for existing ones to be overwritten too. Ollama KV
+# contexts and rolling conversation summaries are caches and are left out;
+# they are rebuilt on the next chat turn.
+
+FORMAT_VERSION = 1
+ROLE_FIELDS = ('provider', 'model', 'system_prompt', 'web_search', 'temperature', 'cache_responses')
+EXPORTED_COLUMNS = {
+    'role': ('id', 'name') + ROLE_FIELDS,
+    'provider_settings': ('provider_name', 'ollama_url', 'models'),
+    'project': ('id', 'name', 'description', 'updated_at'),
+    'conversation': ('id', 'project_id', 'role_id', 'created_at'),
+    'message': ('id', 'conversation_id', 'project_id', 'sender', 'content', 'created_at'),
+}
+TABLES = {
+    'role': Role.__table__,
+    'provider_settings': ProviderSettings.__table__,
+    'project': Project.__table__,
+    'conversation': Conversation.__table__,
+    'message': Message.__table__,
+}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot export {type(value).__name__}')
+
+
+def _line(kind, data):
+    return json.dumps({'type': kind, 'data': data}, default=_json_default) + '\n'
+
+
+def export_user(user_id):
+    # Yields the NDJSON lines of a user's data
+    with app.app_context():
+        engine = db.engine
+    batch_size = app.config['TRANSFER_BATCH_SIZE']
+    projects = TABLES['project']
+    user_projects = db.select(projects.c.id).where(projects.c.user_id == user_id)
+    queries = [
+        ('role', None),
+        ('provider_settings', TABLES['provider_settings'].c.user_id == user_id),
+        ('project', projects.c.user_id == user_id),
+        ('conversation', TABLES['conversation'].c.project_id.in_(user_projects)),
+        ('message', TABLES['message'].c.project_id.in_(user_projects)),
+    ]
+    yield _line('header', {'version': FORMAT_VERSION, 'exported_at': datetime.utcnow()})
+    with engine.connect() as conn:
+        streaming = conn.execution_options(stream_results=True, yield_per=batch_size)
+        for kind, where in queries:
+            table = TABLES[kind]
+            query = db.select(*[table.c[name] for name in EXPORTED_COLUMNS[kind]]).order_by(table.c.id)
+            if where is not None:
+                query = query.where(where)
+            for row in streaming.execute(query):
+                yield _line(kind, dict(row._mapping))
+
+
+def upsert_roles(conn, rows, update=ROLE_FIELDS):
+    # One multi-row INSERT ... ON CONFLICT (name) for all rows; existing roles
+    # are left alone when there is nothing to update
+    if not rows:
+        return
+    table = TABLES['role']
+    insert = (postgresql if conn.dialect.name == 'postgresql' else sqlite).insert(table).values(rows)
+    if not update:
+        conn.execute(insert.on_conflict_do_nothing(index_elements=['name']))
+        return
+    conn.execute(insert.on_conflict_do_update(
+        index_elements=['name'], set_={name: insert.excluded[name] for name in update},
+    ))
+
+
+class Importer:
+    def __init__(self, conn, user_id, update_roles=False):
+        self.conn = conn
+        self.user_id = user_id
+        self.update_roles = update_roles
+        self.batch_size = app.config['TRANSFER_BATCH_SIZE']
+        self.kind = None
+        self.batch = []
+        self.counts = dict.fromkeys(EXPORTED_COLUMNS, 0)
+        # Old id -> new id; messages have no children, so are not kept
+        self.ids = {'role': {}, 'project': {}, 'conversation': {}}
+
+    def feed(self, line):
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise ValueError('Expected a JSON object')
+        kind, data = record.get('type'), record.get('data') or {}
+        if not isinstance(data, dict):
+            raise ValueError(f'data of a {kind!r} record must be an object')
+        if kind == 'header':
+            if data.get('version') != FORMAT_VERSION:
+                raise ValueError(f"Unsupported export version {data.get('version')}")
+            return
+        if kind not in EXPORTED_COLUMNS:
+            raise ValueError(f'Unknown record type {kind!r}')
+        if kind != self.kind or len(self.batch) >= self.batch_size:
+            self.flush()
+            self.kind = kind
+        self.batch.append(self._decode(kind, data))
+
+    def flush(self):
+        if self.batch:
+            getattr(self, f'_import_{self.kind}')(self.batch)
+            self.counts[self.kind] += len(self.batch)
+            self.batch = []
+
+    def _decode(self, kind, data):
+        table = TABLES[kind]
+        row = {}
+        for name in EXPORTED_COLUMNS[kind]:
+            value = data.get(name)
+            if value is not None and isinstance(table.c[name].type, db.DateTime):
+                value = datetime.fromisoformat(value)
+            row[name] = value
+        return row
+
+    def _import_role(self, rows):
+        by_name = {row['name']: row for row in rows}
+        upsert_roles(self.conn, [{name: row[name] for name in ('name',) + ROLE_FIELDS} for row in by_name.values()],
+                     update=ROLE_FIELDS if self.update_roles else ())
+        table = TABLES['role']
+        for role_id, name in self.conn.execute(db.select(table.c.id, table.c.name).where(table.c.name.in_(by_name))):
+            self.ids['role'][by_name[name]['id']] = role_id
+
+    def _import_provider_settings(self, rows):
+        table = TABLES['provider_settings']
+        self.conn.execute(db.delete(table).where(table.c.user_id == self.user_id))
+        self.conn.execute(db.insert(table), [dict(row, user_id=self.user_id) for row in rows[-1:]])
+
+    def _import_project(self, rows):
+        self._insert_with_new_ids('project', rows, lambda row: dict(row, user_id=self.user_id))
+
+    def _import_conversation(self, rows):
+        projects, roles = self.ids['project'], self.ids['role']
+        self._insert_with_new_ids('conversation', rows, lambda row: dict(
+            row, project_id=projects[row['project_id']], role_id=roles.get(row['role_id'])))
+
+    def _import_message(self, rows):
+        projects, conversations = self.ids['project'], self.ids['conversation']
+        self._insert_with_new_ids('message', rows, lambda row: dict(
+            row, project_id=projects[row['project_id']], conversation_id=conversations[row['conversation_id']]))
+
+    def _insert_with_new_ids(self, kind, rows, remap):
+        try:
+            rows = [remap(row) for row in rows]
+        except KeyError as e:
+            raise ValueError(f'{kind} refers to id {e} that is not in the export') from None
+        table = TABLES[kind]
+        new_ids = self._allocate_ids(table, len(rows))
+        for row, new_id in zip(rows, new_ids):
+            if kind in self.ids:
+                self.ids[kind][row['id']] = new_id
+            row['id'] = new_id
+        if self.conn.dialect.name == 'postgresql':
+            self._copy(table, rows)
+        else:
+            self.conn.execute(db.insert(table), rows)
+
+    def _allocate_ids(self, table, count):
+        if self.conn.dialect.name == 'postgresql':
+            return self.conn.execute(
+                db.text("SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"),
+                {'table': table.name, 'count': count},
+            ).scalars().all()
+        # SQLite has no sequences; the importing transaction holds the write lock
+        start = self.conn.execute(db.select(db.func.max(table.c.id))).scalar() or 0
+        return list(range(start + 1, start + count + 1))
+
+    def _copy(self, table, rows):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write(','.join(_csv_field(row[name]) for name in columns) + '\n')
+        preparer = self.conn.dialect.identifier_preparer
+        sql = (f"COPY {preparer.format_table(table)} ({', '.join(preparer.quote(name) for name in columns)}) "
+               "FROM STDIN WITH (FORMAT csv)")
+        with self.conn.connection.dbapi_connection.cursor() as cursor:
+            if hasattr(cursor, 'copy_expert'):  # psycopg2
+                buffer.seek(0)
+                cursor.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+
+def _csv_field(value):
+    # Unquoted empty is NULL in COPY's CSV format, so every value is quoted
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def import_user(user_id, lines, update_roles=False):
+    # Imports NDJSON lines into user_id's account in one transaction and
+    # returns the number of records of each type. Raises ValueError for
+    # malformed input, leaving the database untouched. Existing roles are
+    # only overwritten with update_roles.
+    with app.app_context():
+        engine = db.engine
+    with engine.begin() as conn:
+        importer = Importer(conn, user_id, update_roles)
+        number = 0
+        try:
+            for number, line in enumerate(lines, 1):
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                importer.feed(line)
+            importer.flush()
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f'Line {number}: {e}') from e
+        except (IntegrityError, DataError) as e:
+            # Rows are written a batch at a time, so the bad row is in the
+            # batch that ends at this line
+            raise ValueError(f'Line {number}: {e.orig}') from e
+    with app.app_context():
+        lookup_cache.bump(lookup_cache.ROLE, lookup_cache.PROVIDER_SETTINGS)
+        db.session.commit()
+    return importer.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import a user's projects, roles and settings as NDJSON")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    export_parser = subcommands.add_parser('export')
+    export_parser.add_argument('--username', required=True)
+    export_parser.add_argument('-o', '--output', help='file to write (default: stdout)')
+    import_parser = subcommands.add_parser('import')
+    import_parser.add_argument('--username', required=True)
+    import_parser.add_argument('--update-roles', action='store_true',
+                               help='overwrite roles that already exist with the same name')
+    import_parser.add_argument('input', help="NDJSON file, or '-' for stdin")
+    args = parser.parse_args()
+
+    with app.app_context():
+        user = User.query.filter_by(username=args.username).first()
+        if not user:
+            raise SystemExit(f'No user named {args.username}')
+        user_id = user.id
+
+    if args.command == 'export':
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            output.writelines(export_user(user_id))
+        finally:
+            if args.output:
+                output.close()
+    else:
+        source = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+        try:
+            counts = import_user(user_id, source, update_roles=args.update_roles)
+        except ValueError as e:
+            raise SystemExit(f'Import failed: {e}')
+        finally:
+            if args.input != '-':
+                source.close()
+        print(', '.join(f'{count} {kind}' for kind, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
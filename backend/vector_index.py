@@ -0,0 +1,128 @@
+import json
+import os
+
+import numpy as np
+
+# Append-only store of unit-length float32 vectors with one JSON metadata
+# record per row, searched by cosine similarity. Three files share a prefix:
+#
+#     <prefix>.f32      rows x dim float32 vectors, memory-mapped for search
+#     <prefix>.jsonl    one metadata line per row
+#     <prefix>.offsets  uint64 start offset of each metadata line, so a search
+#                       reads only the lines of the rows it returns
+#
+# <prefix>.json records how many rows are complete. It is replaced atomically
+# after the data files have been written, so readers never see a partial row
+# and a crashed append is truncated away by the next one. Writers must hold
+# an external lock; readers take none. Appends never touch rows a reader can
+# see, but clear() removes the files, so a search that read the state just
+# before a clear can fail with OSError or ValueError and should be treated as
+# finding nothing.
+
+SEARCH_BLOCK_ROWS = 65536
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class VectorStore:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.state_path = f'{prefix}.json'
+
+    def state(self):
+        try:
+            with open(self.state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'rows': 0, 'dim': None, 'meta_bytes': 0}
+
+    def _write_state(self, state):
+        tmp_path = f'{self.state_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def append(self, vectors, metadata, **extra):
+        # Adds rows and merges extra keys (e.g. progress markers) into the state
+        state = self.state()
+        if metadata:
+            vectors = normalize(vectors)
+            if state['dim'] not in (None, vectors.shape[1]):
+                raise ValueError(f"Vector size {vectors.shape[1]} does not match index size {state['dim']}")
+            lines = [(json.dumps(item) + '\n').encode('utf-8') for item in metadata]
+            sizes = [len(line) for line in lines]
+            offsets = state['meta_bytes'] + np.cumsum([0] + sizes[:-1])
+            for suffix, data, size in (
+                ('.f32', vectors.tobytes(), state['rows'] * vectors.shape[1] * 4),
+                ('.jsonl', b''.join(lines), state['meta_bytes']),
+                ('.offsets', offsets.astype(np.uint64).tobytes(), state['rows'] * 8),
+            ):
+                with open(self.prefix + suffix, 'ab') as f:
+                    f.truncate(size)  # drop anything a crashed append left behind
+                    f.write(data)
+            state['rows'] += len(metadata)
+            state['meta_bytes'] += sum(sizes)
+            state['dim'] = vectors.shape[1]
+        state.update(extra)
+        self._write_state(state)
+        return state
+
+    def clear(self, **extra):
+        # The empty state goes first, so new searches stop opening the files
+        state = {'rows': 0, 'dim': None, 'meta_bytes': 0}
+        state.update(extra)
+        self._write_state(state)
+        for suffix in ('.f32', '.jsonl', '.offsets'):
+            try:
+                os.remove(self.prefix + suffix)
+            except FileNotFoundError:
+                pass
+        return state
+
+    def search(self, queries, k, min_score=-1.0):
+        # Top-k rows per query as lists of (score, metadata), best first.
+        # The vectors are scanned in blocks so memory use stays flat.
+        state = self.state()
+        queries = normalize(queries)
+        if not state['rows'] or queries.shape[1] != state['dim']:
+            return [[] for _ in range(len(queries))]
+
+        vectors = np.memmap(self.prefix + '.f32', dtype=np.float32, mode='r', shape=(state['rows'], state['dim']))
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, state['rows'], SEARCH_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + SEARCH_BLOCK_ROWS])
+            scores = queries @ block.T
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, start + len(block)), scores.shape)], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+        del vectors
+
+        order = np.argsort(-best_scores, axis=1)
+        results = []
+        for query_scores, query_rows, query_order in zip(best_scores, best_rows, order):
+            hits = [(float(query_scores[i]), int(query_rows[i])) for i in query_order if query_scores[i] >= min_score]
+            records = self._metadata([row for _, row in hits])
+            results.append([(score, record) for (score, _), record in zip(hits, records)])
+        return results
+
+    def _metadata(self, rows):
+        if not rows:
+            return []
+        offsets = np.memmap(self.prefix + '.offsets', dtype=np.uint64, mode='r')
+        records = []
+        with open(self.prefix + '.jsonl', 'rb') as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                records.append(json.loads(f.readline()))
+        return records
@@ -0,0 +1,416 @@
+import codecs
+import hashlib
+import ipaddress
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from app import app
+
+# Web search for roles with Role.web_search set. The user's prompt goes to a
+# search backend, the top results are fetched concurrently and reduced to
+# their main text, and the excerpts are added to the prompt. The whole stage
+# runs against one deadline (WEB_SEARCH_TIMEOUT): pages that are not back in
+# time fall back to the search snippet and keep loading in the background, so
+# the next turn on the same topic finds them in the cache.
+#
+# Search results and page text are cached per process with a TTL and a size
+# bound. Concurrent lookups of the same query or URL share one request.
+#
+# Result URLs come from the open web, so pages are only fetched over http(s)
+# from hosts that resolve to public addresses, and redirects are followed by
+# hand with the same check on every hop. Otherwise a result that redirects to
+# localhost, a private network or a cloud metadata address would have that
+# content pulled into the prompt. The check is repeated on the address each
+# connection actually reaches, since a host can resolve to something else by
+# the time requests connects; pages are therefore fetched without proxies.
+
+SKIPPED_TAGS = {'script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form', 'svg', 'iframe', 'template'}
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'tr', 'section', 'article', 'main', 'pre'}
+MAIN_TAGS = {'article', 'main'}
+USER_AGENT = 'IdeaIncubator/1.0 (+web search for AI agent roles)'
+
+
+class _TextExtractor(HTMLParser):
+    # Visible text of a page, preferring <article>/<main> when there is one
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skipping = 0
+        self.main_depth = 0
+        self.title = []
+        self.in_title = False
+        self.text = []
+        self.main_text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in MAIN_TAGS:
+            self.main_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+        if tag in BLOCK_TAGS:
+            self._append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+        elif tag in MAIN_TAGS and self.main_depth:
+            self.main_depth -= 1
+        elif tag == 'title':
+            self.in_title = False
+        if tag in BLOCK_TAGS:
+            self._append('\n')
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+        elif not self.skipping:
+            self._append(data)
+
+    def _append(self, data):
+        self.text.append(data)
+        if self.main_depth:
+            self.main_text.append(data)
+
+
+def extract_text(html, max_chars):
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass  # keep whatever was parsed before the markup broke
+    main = _clean(''.join(parser.main_text))
+    text = main if len(main) >= 200 else _clean(''.join(parser.text))
+    return _clean(''.join(parser.title)), truncate(text, max_chars)
+
+
+def _clean(text):
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in text.split('\n'))
+    # Menus and button labels are mostly one or two words per line
+    return '\n'.join(line for line in lines if len(line.split()) > 3)
+
+
+def truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut if cut > max_chars // 2 else max_chars].rstrip() + '…'
+
+
+class TTLCache:
+    # LRU cache whose entries also expire. Values are sized by their text
+    # length so the total stays under max_bytes.
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, size, ttl=None):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get_or_load(self, key, load, size_of, timeout, ttl_of=None):
+        # One loader per key; concurrent callers wait up to timeout for it.
+        # Returns None if the value is not available in time.
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = threading.Event()
+        if leader:
+            try:
+                value = load()
+                if value is not None:
+                    self.put(key, value, size_of(value), ttl_of(value) if ttl_of else None)
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.set()
+            return value
+        flight.wait(timeout)
+        return self.get(key)
+
+
+class SearxngBackend:
+    # A SearXNG instance with the JSON output format enabled
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def search(self, session, query, limit, timeout):
+        response = session.get(f'{self.url}/search', params={'q': query, 'format': 'json'}, timeout=timeout)
+        response.raise_for_status()
+        return [
+            {'url': item['url'], 'title': item.get('title') or '', 'snippet': item.get('content') or ''}
+            for item in response.json().get('results', [])[:limit] if item.get('url')
+        ]
+
+
+class StubBackend:
+    # Canned results with their text included, for offline use and local
+    # development without a search instance
+    def search(self, session, query, limit, timeout):
+        slug = hashlib.sha1(query.encode('utf-8')).hexdigest()[:8]
+        return [
+            {'url': f'https://example.invalid/{slug}/{n}', 'title': f'Result {n + 1} for {query}',
+             'snippet': f'Stub search result {n + 1} about {query}.',
+             'text': f'Stub page {n + 1}. This page discusses {query} in some detail.'}
+            for n in range(limit)
+        ]
+
+
+def get_backend():
+    if app.config['WEB_SEARCH_BACKEND'] == 'stub':
+        return StubBackend()
+    if app.config['WEB_SEARCH_BACKEND'] == 'searxng' and app.config['WEB_SEARCH_URL']:
+        return SearxngBackend(app.config['WEB_SEARCH_URL'])
+    return None
+
+
+class _PublicOnlyConnection:
+    # Refuses sockets that connected to a non-public address
+    def _new_conn(self):
+        sock = super()._new_conn()
+        address = sock.getpeername()[0]
+        if not is_public_address(address):
+            sock.close()
+            raise NewConnectionError(self, f'{self.host} resolved to non-public address {address}')
+        return sock
+
+
+class _PublicHTTPConnection(_PublicOnlyConnection, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicOnlyConnection, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicOnlyAdapter(HTTPAdapter):
+    # Transport for result pages: connections are checked where they land
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _PublicHTTPConnectionPool,
+                                                   'https': _PublicHTTPSConnectionPool}
+
+
+class WebSearch:
+    def __init__(self):
+        self._session = None
+        self._page_session = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._results = None
+        self._pages = None
+
+    def _ensure_started(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    workers = app.config['WEB_SEARCH_FETCH_WORKERS']
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers['User-Agent'] = USER_AGENT
+                    # The search backend may well be on a private address;
+                    # result pages get their own session that refuses those
+                    page_session = requests.Session()
+                    page_session.trust_env = False
+                    page_adapter = PublicOnlyAdapter(pool_connections=workers, pool_maxsize=workers)
+                    page_session.mount('http://', page_adapter)
+                    page_session.mount('https://', page_adapter)
+                    page_session.headers['User-Agent'] = USER_AGENT
+                    self._page_session = page_session
+                    max_bytes = app.config['WEB_SEARCH_CACHE_BYTES']
+                    self._results = TTLCache(max_bytes // 8, app.config['WEB_SEARCH_CACHE_TTL'])
+                    self._pages = TTLCache(max_bytes, app.config['WEB_SEARCH_CACHE_TTL'])
+                    self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='web-fetch')
+                    self._session = session
+
+    def search(self, query):
+        # Up to WEB_SEARCH_RESULTS (title, url, text) tuples for the prompt,
+        # or [] if search is off or failed
+        backend = get_backend()
+        query = re.sub(r'\s+', ' ', query).strip()[:app.config['WEB_SEARCH_MAX_QUERY_CHARS']]
+        if backend is None or not query:
+            return []
+        self._ensure_started()
+        deadline = time.monotonic() + app.config['WEB_SEARCH_TIMEOUT']
+        limit = app.config['WEB_SEARCH_RESULTS']
+
+        def load_results():
+            try:
+                return backend.search(self._session, query, limit, max(deadline - time.monotonic(), 0.05))
+            except (requests.RequestException, ValueError, KeyError) as e:
+                app.logger.warning("Web search for %r failed: %s", query, e)
+                return None
+
+        results = self._results.get_or_load(('query', type(backend).__name__, query.lower()), load_results,
+                                            lambda value: sum(len(str(item)) for item in value),
+                                            max(deadline - time.monotonic(), 0))
+        if not results:
+            return []
+
+        futures = {}
+        for result in results:
+            if result.get('text') is None:
+                futures[result['url']] = self._executor.submit(self._page_text, result['url'], deadline)
+        wait(list(futures.values()), timeout=max(deadline - time.monotonic(), 0))
+
+        max_chars = app.config['WEB_SEARCH_MAX_CHARS']
+        excerpts = []
+        for result in results:
+            title, text = result['title'], result.get('text')
+            future = futures.get(result['url'])
+            page = None
+            if future is not None and future.done():
+                if future.exception() is not None:
+                    app.logger.warning("Fetching %s for web search failed: %s", result['url'], future.exception())
+                else:
+                    page = future.result()
+            if page:
+                page_title, page_text = page
+                title = title or page_title
+                text = page_text or text
+            text = truncate(text or result['snippet'], max_chars)
+            if text:
+                excerpts.append((title or result['url'], result['url'], text))
+        return excerpts
+
+    def _page_text(self, url, deadline):
+        # (title, text) of the page; failures are cached briefly as empty text
+        return self._pages.get_or_load(
+            ('page', url), lambda: self._fetch(url), lambda value: len(value[0]) + len(value[1]) + 1,
+            max(deadline - time.monotonic(), 0),
+            ttl_of=lambda value: None if value[1] else app.config['WEB_SEARCH_FAILURE_TTL'],
+        )
+
+    def _fetch(self, url):
+        # Runs to completion even after the caller's deadline, so a slow page
+        # still lands in the cache; the read timeout bounds each socket read
+        max_bytes = app.config['WEB_SEARCH_MAX_PAGE_BYTES']
+        timeout = (app.config['WEB_SEARCH_CONNECT_TIMEOUT'], app.config['WEB_SEARCH_READ_TIMEOUT'])
+        try:
+            for _ in range(app.config['WEB_SEARCH_MAX_REDIRECTS'] + 1):
+                if not is_public_url(url):
+                    app.logger.info("Not fetching %s for web search: not a public http(s) address", url)
+                    return '', ''
+                response = self._page_session.get(url, timeout=timeout, stream=True, allow_redirects=False)
+                if not response.is_redirect:
+                    break
+                response.close()
+                url = urljoin(url, response.headers['Location'])
+            else:
+                app.logger.info("Not fetching %s for web search: too many redirects", url)
+                return '', ''
+            with response:
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '')
+                if 'html' not in content_type and 'text/plain' not in content_type:
+                    return '', ''
+                body = b''
+                for chunk in response.iter_content(16384):
+                    body += chunk
+                    if len(body) >= max_bytes:
+                        break
+                encoding = _codec(response.encoding)
+        except requests.RequestException as e:
+            app.logger.info("Fetching %s for web search failed: %s", url, e)
+            return '', ''
+        html = body[:max_bytes].decode(encoding, errors='replace')
+        if 'text/plain' in content_type:
+            return '', truncate(_clean(html), app.config['WEB_SEARCH_MAX_CHARS'])
+        return extract_text(html, app.config['WEB_SEARCH_MAX_CHARS'])
+
+
+def _codec(name):
+    # The charset comes from the page, so unknown names fall back to UTF-8
+    try:
+        return codecs.lookup(name or 'utf-8').name
+    except LookupError:
+        return 'utf-8'
+
+
+def is_public_url(url):
+    # http(s) URL whose host resolves only to globally routable addresses
+    try:
+        parts = urlparse(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        infos = socket.getaddrinfo(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError):
+        return False
+    return bool(infos) and all(is_public_address(info[4][0]) for info in infos)
+
+
+def is_public_address(address):
+    address = ipaddress.ip_address(address.split('%', 1)[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def format_results(excerpts):
+    # One note per result, in the shape build_prompt() takes for notes
+    return [f'{title} ({url}): {text}' for title, url, text in excerpts]
+
+
+def with_web_results(prompt, results):
+    # For prompts that don't go through build_prompt (panels, agent jobs)
+    if not results:
+        return prompt
+    return 'Web search results:\n' + '\n'.join(f'- {result}' for result in results) + f'\n\n{prompt}'
+
+
+web_search = WebSearch()
@@ -0,0 +1,94 @@
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db
+from jobs import claim_job, requeue_stale_jobs, run_job, stub_generate
+from model_catalog import warmup_scheduler
+from models import AgentJob
+from ollama_client import stream_generate
+
+# Runs queued agent jobs outside the web process:
+#
+#     python worker.py            # real Ollama backends from ProviderSettings
+#     python worker.py --stub     # echo stub, for local testing without a GPU
+
+
+def model_limits():
+    limits = {}
+    for item in app.config['JOB_MODEL_CONCURRENCY_OVERRIDES'].split(','):
+        if ':' in item:
+            model, limit = item.rsplit(':', 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Idea Incubator agent job worker')
+    parser.add_argument('--stub', action='store_true', help='use a stub LLM instead of Ollama')
+    args = parser.parse_args()
+
+    generate = stub_generate if args.stub else stream_generate
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    concurrency = app.config['JOB_WORKER_CONCURRENCY']
+    default_limit = app.config['JOB_MODEL_CONCURRENCY']
+    limits = model_limits()
+    poll_interval = app.config['JOB_POLL_INTERVAL']
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    running = Counter()
+    running_lock = threading.Lock()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='job')
+
+    def execute(job_id, model):
+        try:
+            with app.app_context():
+                job = db.session.get(AgentJob, job_id)
+                app.logger.info("Worker %s running agent job %s (%s)", worker_id, job_id, model)
+                run_job(job, generate=generate)
+        except Exception:
+            app.logger.exception("Agent job %s crashed the worker thread", job_id)
+        finally:
+            with running_lock:
+                running[model] -= 1
+
+    if app.config['MODEL_WARMUP_ENABLED'] and not args.stub:
+        warmup_scheduler.ensure_started()
+
+    app.logger.info("Worker %s started with concurrency %d", worker_id, concurrency)
+    last_requeue = 0
+    with app.app_context():
+        while not stopping.is_set():
+            if time.monotonic() - last_requeue > 60:
+                requeue_stale_jobs()
+                last_requeue = time.monotonic()
+
+            with running_lock:
+                busy = sum(running.values())
+                saturated = [model for model, count in running.items() if count >= limits.get(model, default_limit)]
+            if busy >= concurrency:
+                stopping.wait(poll_interval)
+                continue
+
+            job = claim_job(worker_id, exclude_models=saturated)
+            if not job:
+                stopping.wait(poll_interval)
+                continue
+            with running_lock:
+                running[job.model] += 1
+            executor.submit(execute, job.id, job.model)
+
+    app.logger.info("Worker %s shutting down, waiting for running jobs", worker_id)
+    executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    main()
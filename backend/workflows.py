@@ -0,0 +1,202 @@
+import hashlib
+import json
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from jobs import new_job
+from models import AgentJob, Project, Role, StageOutput, WorkflowRun, WorkflowStage
+
+# Runs a DAG of role stages over a project. A stage becomes runnable once all
+# of its upstream stages have succeeded; it is then queued as an agent job, so
+# independent stages run in parallel on the job workers. When a stage job
+# finishes, the run is advanced again.
+#
+# Every stage output is stored in stage_output under a hash of the stage's
+# inputs: the prompt (project, instructions and upstream outputs), the role's
+# system prompt, model and temperature. A stage whose hash is already there
+# is completed from the cache without calling the LLM, so after editing the
+# project or one role only the stages downstream of the change run again.
+
+DEFAULT_STAGES = [
+    {'name': 'plan', 'role': 'AI Agent - Project Planner', 'depends_on': []},
+    {'name': 'architecture', 'role': 'AI Agent - Architect', 'depends_on': ['plan']},
+    {'name': 'ux', 'role': 'AI Agent - UX SME', 'depends_on': ['architecture']},
+    {'name': 'database', 'role': 'AI Agent - DB SME', 'depends_on': ['architecture']},
+    {'name': 'implementation', 'role': 'AI Agent - Developer', 'depends_on': ['architecture', 'ux', 'database']},
+    {'name': 'validation', 'role': 'AI Agent - Code Validator', 'depends_on': ['implementation']},
+    {'name': 'testing', 'role': 'AI Agent - Application Tester', 'depends_on': ['implementation', 'validation']},
+]
+
+TERMINAL_STAGE_STATUSES = ('succeeded', 'failed', 'skipped')
+
+
+def resolve_stages(stages):
+    # Checks a stage list from a request and resolves each role by id or
+    # name. Raises ValueError with a message for the client.
+    if not isinstance(stages, list) or not all(isinstance(stage, dict) for stage in stages):
+        raise ValueError('stages must be a list of objects')
+    max_name = WorkflowStage.name.type.length
+    resolved = []
+    names = set()
+    for stage in stages:
+        name = str(stage.get('name') or '').strip()
+        if not name or name in names:
+            raise ValueError(f'Stage names must be unique and non-empty: {name!r}')
+        if len(name) > max_name:
+            raise ValueError(f'Stage names must be at most {max_name} characters')
+        role_id = stage.get('role_id')
+        if role_id:
+            if not isinstance(role_id, int) or isinstance(role_id, bool):
+                raise ValueError(f'role_id of stage {name} must be an integer')
+            role = db.session.get(Role, role_id)
+        elif isinstance(stage.get('role'), str):
+            role = Role.query.filter_by(name=stage['role']).first()
+        else:
+            role = None
+        if not role:
+            raise ValueError(f'Role for stage {name} not found')
+        if not role.model:
+            raise ValueError(f'No model assigned to role {role.name}')
+        depends_on = stage.get('depends_on') or []
+        if not isinstance(depends_on, list) or not all(isinstance(upstream, str) for upstream in depends_on):
+            raise ValueError(f'depends_on of stage {name} must be a list of stage names')
+        depends_on = list(dict.fromkeys(depends_on))
+        for upstream in depends_on:
+            if upstream not in names:
+                raise ValueError(f'Stage {name} depends on {upstream}, which must be listed before it')
+        names.add(name)
+        resolved.append({'name': name, 'role': role, 'depends_on': depends_on})
+    if not resolved:
+        raise ValueError('A workflow needs at least one stage')
+    return resolved
+
+
+def start_workflow(user_id, project, stages, instructions=None):
+    # Stages must come in topological order, which also rules out cycles
+    run = WorkflowRun(user_id=user_id, project_id=project.id, instructions=instructions)
+    db.session.add(run)
+    db.session.flush()
+    for stage in stages:
+        db.session.add(WorkflowStage(run_id=run.id, name=stage['name'], role_id=stage['role'].id,
+                                     depends_on=json.dumps(stage['depends_on'])))
+    db.session.commit()
+    advance(run.id)
+    return run
+
+
+def stage_prompt(project, instructions, stage, upstream_outputs):
+    parts = [f'Project: {project.name}', project.description or '']
+    if instructions:
+        parts.append(f'Instructions: {instructions}')
+    for name, output in upstream_outputs:
+        parts.append(f'## Output of the {name} stage\n\n{output}')
+    parts.append(f'Carry out the {stage.name} stage for this project.')
+    return '\n\n'.join(part for part in parts if part)
+
+
+def input_hash(prompt, role):
+    material = json.dumps([prompt, role.system_prompt, role.model, role.temperature])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def advance(run_id):
+    # Queues every stage whose inputs are ready and completes cached ones.
+    # The run row is locked so concurrent stage completions advance it one at
+    # a time and never queue a stage twice.
+    run = WorkflowRun.query.filter_by(id=run_id).with_for_update().first()
+    if run is None or run.status != 'running':
+        db.session.rollback()
+        return
+    project = db.session.get(Project, run.project_id)
+    stages = {stage.name: stage for stage in run.stages}
+
+    progressed = True
+    while progressed:
+        progressed = False
+        for stage in stages.values():
+            if stage.status != 'pending':
+                continue
+            upstream = [stages[name] for name in json.loads(stage.depends_on)]
+            if any(up.status in ('failed', 'skipped') for up in upstream):
+                stage.status = 'skipped'
+                progressed = True
+                continue
+            if any(up.status != 'succeeded' for up in upstream):
+                continue
+
+            role = db.session.get(Role, stage.role_id) if stage.role_id else None
+            if role is None or not role.model:
+                stage.status = 'failed'
+                stage.error = 'Role was deleted or has no model'
+                progressed = True
+                continue
+            outputs = {row.input_hash: row.output for row in StageOutput.query.filter(
+                StageOutput.input_hash.in_([up.input_hash for up in upstream]))}
+            prompt = stage_prompt(project, run.instructions, stage,
+                                  [(up.name, outputs.get(up.input_hash, '')) for up in upstream])
+            stage.input_hash = input_hash(prompt, role)
+            if db.session.get(StageOutput, stage.input_hash):
+                stage.status = 'succeeded'
+                stage.cached = True
+                progressed = True
+                continue
+
+            job = new_job(run.user_id, run.project_id, role, prompt, workflow_stage_id=stage.id)
+            db.session.add(job)
+            db.session.flush()
+            stage.job_id = job.id
+            stage.status = 'queued'
+
+    statuses = [stage.status for stage in stages.values()]
+    if all(status in TERMINAL_STAGE_STATUSES for status in statuses):
+        run.status = 'succeeded' if all(status == 'succeeded' for status in statuses) else 'failed'
+        app.logger.info("Workflow run %s %s", run.id, run.status)
+    run.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def stage_succeeded(job):
+    stage = db.session.get(WorkflowStage, job.workflow_stage_id)
+    if stage is None:
+        db.session.commit()
+        return
+    if not db.session.get(StageOutput, stage.input_hash):
+        try:
+            with db.session.begin_nested():
+                db.session.add(StageOutput(input_hash=stage.input_hash, model=job.model, output=job.result))
+        except IntegrityError:
+            pass  # a stage with the same inputs in another run got there first
+    stage.status = 'succeeded'
+    stage.error = None
+    db.session.commit()
+    advance(stage.run_id)
+
+
+def stage_failed(job):
+    stage = db.session.get(WorkflowStage, job.workflow_stage_id)
+    if stage is None:
+        return
+    stage.status = 'failed'
+    stage.error = job.error
+    db.session.commit()
+    advance(stage.run_id)
+
+
+def workflow_details(run):
+    stages = run.stages
+    hashes = [stage.input_hash for stage in stages if stage.status == 'succeeded']
+    outputs = {row.input_hash: row.output for row in StageOutput.query.filter(StageOutput.input_hash.in_(hashes))}
+    jobs = {job.id: job for job in AgentJob.query.filter(
+        AgentJob.id.in_([stage.job_id for stage in stages if stage.job_id]))}
+    details = run.to_dict()
+    details['stages'] = []
+    for stage in stages:
+        item = stage.to_dict()
+        if stage.status == 'succeeded':
+            item['output'] = outputs.get(stage.input_hash)
+        elif stage.job_id in jobs:
+            item['progress'] = jobs[stage.job_id].progress
+        details['stages'].append(item)
+    return details
@@ -0,0 +1,3 @@
+from app import app
+
+# WSGI entry point, e.g. gunicorn -c gunicorn.conf.py wsgi:app